@@ -2,7 +2,15 @@ import pandas as pd
 import boto3
 import json
 import configparser
+import sys
+import time
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+import ETL
+import create_tables
+from Create_S3_Buckets import REGION, source_settings, stage_data
+from db_session import update_config_file
 
 
 def load_config(config_file):
@@ -81,55 +89,91 @@ def pretty_redshift_props(props):
     return pd.DataFrame(data=data, columns=["Key", "Value"])
 
 
+def wait_for_cluster(redshift_client, cluster_identifier, delay=30, max_attempts=60):
+    """Block on the cluster_available waiter and return the cluster's properties."""
+    try:
+        print(f"Waiting for {cluster_identifier} to become available...")
+        redshift_client.get_waiter('cluster_available').wait(
+            ClusterIdentifier=cluster_identifier,
+            WaiterConfig={"Delay": delay, "MaxAttempts": max_attempts}
+        )
+    except Exception as e:
+        print(f"Error waiting for cluster: {e}")
+        raise
+    return describe_cluster(redshift_client, cluster_identifier)
+
+
+def bring_up(config, redshift, iam, s3, dwh_config_file='dwh.cfg', run_etl=True):
+    """
+    Provision the warehouse and load it, overlapping work with cluster boot.
+
+    Data validation and upload start first on a background thread. The IAM
+    role and cluster are created meanwhile, and the waiter blocks until the
+    cluster is available. The endpoint, role ARN and staging manifests are
+    then written to dwh_config_file before create_tables and the ETL run,
+    so cold start is bounded by cluster boot time rather than the sum of
+    the steps.
+    """
+    start = time.perf_counter()
+    dwh = config['DWH']
+    cluster_identifier = dwh["DWH_CLUSTER_IDENTIFIER"]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        staging = executor.submit(stage_data, config, s3)
+
+        role_arn = create_iam_role(iam, dwh["DWH_IAM_ROLE_NAME"])
+        create_redshift_cluster(redshift, dwh, role_arn)
+        cluster_props = wait_for_cluster(
+            redshift, cluster_identifier,
+            int(dwh.get("WAITER_DELAY", "30")), int(dwh.get("WAITER_MAX_ATTEMPTS", "60"))
+        )
+        print(f"Cluster available after {time.perf_counter() - start:.1f}s")
+        print(pretty_redshift_props(cluster_props))
+
+        sources = staging.result()
+        print(f"Data staged after {time.perf_counter() - start:.1f}s")
+
+    values = {
+        "CLUSTER": {
+            "HOST": cluster_props['Endpoint']['Address'],
+            "DB_NAME": dwh["DWH_DB"],
+            "DB_USER": dwh["DWH_DB_USER"],
+            "DB_PASSWORD": dwh["DWH_DB_PASSWORD"],
+            "DB_PORT": cluster_props['Endpoint'].get('Port', dwh["DWH_PORT"]),
+        },
+        "IAM_ROLE": {"ARN": f"'{role_arn}'"},
+        "S3": source_settings(config, sources),
+    }
+    update_config_file(dwh_config_file, values)
+    print(f"Wrote endpoint {values['CLUSTER']['HOST']} and role ARN to {dwh_config_file}")
+
+    if run_etl:
+        create_tables.main(dwh_config_file)
+        ETL.main(dwh_config_file)
+    print(f"Bring-up finished in {time.perf_counter() - start:.1f}s")
+    return cluster_props
+
+
 def main():
+    """
+    Bring up the cluster, stage the data and load it; --no-etl stops once
+    the cluster is available and dwh.cfg has been updated.
+    """
     # Load configuration
     config = load_config('dwh2.cfg')
-
-    # Extract AWS and cluster configuration
-    aws_config = {
-        "KEY": config.get('AWS', 'KEY'),
-        "SECRET": config.get('AWS', 'SECRET')
-    }
-
-    cluster_config = {
-        "DWH_CLUSTER_TYPE": config.get("DWH", "DWH_CLUSTER_TYPE"),
-        "DWH_NUM_NODES": config.get("DWH", "DWH_NUM_NODES"),
-        "DWH_NODE_TYPE": config.get("DWH", "DWH_NODE_TYPE"),
-        "DWH_CLUSTER_IDENTIFIER": config.get("DWH", "DWH_CLUSTER_IDENTIFIER"),
-        "DWH_DB": config.get("DWH", "DWH_DB"),
-        "DWH_DB_USER": config.get("DWH", "DWH_DB_USER"),
-        "DWH_DB_PASSWORD": config.get("DWH", "DWH_DB_PASSWORD"),
-        "DWH_PORT": config.get("DWH", "DWH_PORT"),
-        "DWH_IAM_ROLE_NAME": config.get("DWH", "DWH_IAM_ROLE_NAME")
+    credentials = {
+        "region_name": REGION,
+        "aws_access_key_id": config.get('AWS', 'KEY'),
+        "aws_secret_access_key": config.get('AWS', 'SECRET')
     }
 
     # Initialize AWS clients
-    redshift = boto3.client(
-        'redshift',
-        region_name="us-west-2",
-        aws_access_key_id=aws_config["KEY"],
-        aws_secret_access_key=aws_config["SECRET"]
-    )
-    iam = boto3.client(
-        'iam',
-        aws_access_key_id=aws_config["KEY"],
-        aws_secret_access_key=aws_config["SECRET"],
-        region_name='us-west-2'
-    )
-
-    # Create IAM role and get ARN
-    role_arn = create_iam_role(iam, cluster_config["DWH_IAM_ROLE_NAME"])
-
-    # Create Redshift cluster
-    create_redshift_cluster(redshift, cluster_config, role_arn)
-
-    # Describe Redshift cluster
-    cluster_props = describe_cluster(redshift, cluster_config["DWH_CLUSTER_IDENTIFIER"])
-    print(pretty_redshift_props(cluster_props))
-
-    print(
-        redshift.describe_clusters(ClusterIdentifier=DWH_CLUSTER_IDENTIFIER)['Clusters'][0]['Endpoint']['Address']
-    )
+    redshift = boto3.client('redshift', **credentials)
+    iam = boto3.client('iam', **credentials)
+    s3 = boto3.client('s3', **credentials)
+
+    bring_up(config, redshift, iam, s3, run_etl="--no-etl" not in sys.argv[1:])
+
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,53 @@
 import boto3
 import configparser
+import gzip
+import json
 import os
+import tempfile
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db_session import update_config_file
+from parquet_convert import csv_to_parquet
+from partitions import (
+    file_hash,
+    load_catalogue,
+    mark_partitions,
+    partition_events,
+    pending_partitions,
+    save_catalogue,
+    save_json,
+    update_catalogue,
+)
+from validate_csv import validate_csv
+
+# Slices per node for each Redshift node type; the number of parts a file
+# is split into defaults to a multiple of the total slice count so COPY
+# can give every slice the same amount of work.
+SLICES_PER_NODE = {
+    "dc2.large": 2,
+    "dc2.8xlarge": 16,
+    "ds2.xlarge": 2,
+    "ds2.8xlarge": 16,
+    "ra3.xlplus": 2,
+    "ra3.4xlarge": 4,
+    "ra3.16xlarge": 16,
+}
+
+# Object metadata key holding the MD5 of an uploaded part's content
+MD5_METADATA = "content-md5"
+
+# Manifests live beside the data prefixes, not in them, so a COPY from a
+# data key prefix never reads a manifest as rows
+MANIFEST_PREFIX = "manifests"
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True
+)
 
 def load_config(config_file):
     """Load configuration from a file."""
@@ -11,7 +57,7 @@ def load_config(config_file):
 
 
 def create_s3_bucket(s3_client, bucket_name, region):
-    """Create an S3 bucket."""
+    """Create an S3 bucket, reusing it if this account already owns it."""
     try:
         print("Creating a new S3 bucket...")
         s3_client.create_bucket(
@@ -22,10 +68,42 @@ def create_s3_bucket(s3_client, bucket_name, region):
         )
         print(f"S3 bucket '{bucket_name}' created successfully.")
     except ClientError as e:
+        if e.response["Error"]["Code"] == "BucketAlreadyOwnedByYou":
+            print(f"S3 bucket '{bucket_name}' already exists, reusing it.")
+            return
         print(f"Error creating S3 bucket: {e}")
         raise
 
 
+def load_upload_cache(path):
+    """Read the local upload cache, or return an empty one."""
+    if not path or not os.path.exists(path):
+        return {"files": {}, "parts": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def remote_matches(s3_client, bucket_name, key, md5, cache):
+    """
+    Return the object's ETag if key already holds content with this MD5, else None.
+
+    The object's content-md5 metadata is checked first; objects uploaded
+    without it match if their ETag is still the one the cache recorded
+    for an upload of the same content.
+    """
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    cached = cache["parts"].get(f"{bucket_name}/{key}", {})
+    if head.get("Metadata", {}).get(MD5_METADATA) == md5 or (
+            cached.get("md5") == md5 and cached.get("etag") == head["ETag"]):
+        return head["ETag"]
+    return None
+
+
 def upload_file_to_s3(s3_client, bucket_name, file_path, s3_key):
     """Upload a file to a specific S3 key."""
     try:
@@ -37,39 +115,354 @@ def upload_file_to_s3(s3_client, bucket_name, file_path, s3_key):
         raise
 
 
-def main():
-    # Load configuration
-    config = load_config('dwh2.cfg')
-    
-    # Extract AWS credentials
-    aws_config = {
-        "KEY": config.get('AWS', 'KEY'),
-        "SECRET": config.get('AWS', 'SECRET'),
-        "REGION": "us-west-2"
+def default_num_parts(config, multiple=1):
+    """Return the cluster slice count from dwh2.cfg times multiple."""
+    nodes = config.getint("DWH", "DWH_NUM_NODES", fallback=1)
+    node_type = config.get("DWH", "DWH_NODE_TYPE", fallback="dc2.large")
+    return nodes * SLICES_PER_NODE.get(node_type, 2) * multiple
+
+
+def split_and_compress(file_path, num_parts, out_dir, part_bytes=None):
+    """
+    Split a CSV file into num_parts gzip files of roughly equal size.
+
+    With part_bytes, parts instead hold part_bytes of input each and their
+    number follows the file size, so appending to the file only changes the
+    last part. Lines are never broken across parts and every part repeats
+    the header, so each one can be loaded with IGNOREHEADER 1. The gzip
+    header carries no timestamp, so identical input gives identical parts.
+    Returns the part paths.
+    """
+    base = os.path.splitext(os.path.basename(file_path))[0]
+    total_size = os.path.getsize(file_path)
+    part_paths = []
+
+    with open(file_path, "rb") as src:
+        header = src.readline()
+        if part_bytes:
+            target, num_parts = part_bytes, None
+        else:
+            target = max(1, (total_size - len(header)) // num_parts)
+        line = src.readline()
+        while line and (num_parts is None or len(part_paths) < num_parts):
+            part_path = os.path.join(out_dir, f"{base}.part{len(part_paths):04d}.csv.gz")
+            written = 0
+            with gzip.GzipFile(part_path, "wb", mtime=0) as dst:
+                dst.write(header)
+                # The last part takes whatever is left over
+                last = num_parts is not None and len(part_paths) == num_parts - 1
+                while line and (last or written < target):
+                    dst.write(line)
+                    written += len(line)
+                    line = src.readline()
+            part_paths.append(part_path)
+
+    return part_paths
+
+
+def upload_part(s3_client, bucket_name, path, key, cache=None):
+    """
+    Upload one part unless the cache shows S3 already has identical content.
+
+    Returns (uploaded, md5, etag). The MD5 is stored as object metadata
+    because multipart ETags are not MD5s.
+    """
+    if cache is None:
+        s3_client.upload_file(path, bucket_name, key, Config=TRANSFER_CONFIG)
+        return True, None, None
+    md5 = file_hash(path)
+    etag = remote_matches(s3_client, bucket_name, key, md5, cache)
+    if etag is not None:
+        return False, md5, etag
+    s3_client.upload_file(path, bucket_name, key, ExtraArgs={"Metadata": {MD5_METADATA: md5}},
+                          Config=TRANSFER_CONFIG)
+    return True, md5, s3_client.head_object(Bucket=bucket_name, Key=key)["ETag"]
+
+
+def upload_parts(s3_client, bucket_name, part_paths, prefix, max_workers=8, cache=None):
+    """
+    Upload part files concurrently under prefix and return their keys.
+
+    With an upload cache, parts whose content is already in S3 are skipped
+    and the cache records what each uploaded key now holds.
+    """
+    keys, skipped = [], 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                upload_part, s3_client, bucket_name, path, f"{prefix}/{os.path.basename(path)}", cache
+            ): path
+            for path in part_paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            key = f"{prefix}/{os.path.basename(path)}"
+            try:
+                uploaded, md5, etag = future.result()
+            except ClientError as e:
+                print(f"Error uploading {os.path.basename(path)}: {e}")
+                raise
+            keys.append(key)
+            if cache is not None:
+                cache["parts"][f"{bucket_name}/{key}"] = {"md5": md5, "etag": etag}
+            if uploaded:
+                print(f"Uploaded {os.path.basename(path)} to {prefix}/ in {bucket_name}.")
+            else:
+                skipped += 1
+    if skipped:
+        print(f"Skipped {skipped} of {len(part_paths)} parts already in {bucket_name}/{prefix}/.")
+    return sorted(keys)
+
+
+def manifest_key_for(prefix, name):
+    """Return the key of the manifest called name for the parts under prefix."""
+    return f"{MANIFEST_PREFIX}/{prefix}/{name}.manifest"
+
+
+def write_manifest(s3_client, bucket_name, manifest_key, keys, sizes=None):
+    """
+    Write a Redshift COPY manifest listing every uploaded part.
+
+    Object sizes are read from S3 unless sizes ({key: bytes}) supplies them.
+    """
+    sizes = sizes or {
+        key: s3_client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+        for key in keys
     }
-    
-    # Define S3 bucket and file paths
-    S3_BUCKET_NAME = "udacity-data-engineering-rohit1998"
-    DATA_DIR = "./data"  # Local directory containing events.csv and songs.csv
+    manifest = {
+        "entries": [
+            {
+                "url": f"s3://{bucket_name}/{key}",
+                "mandatory": True,
+                "meta": {"content_length": sizes[key]}
+            }
+            for key in keys
+        ]
+    }
+    s3_client.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(manifest, indent=2))
+    print(f"Wrote manifest s3://{bucket_name}/{manifest_key} with {len(keys)} entries.")
+    return f"s3://{bucket_name}/{manifest_key}"
+
+
+def upload_cached(s3_client, bucket_name, file_path, prefix, manifest_key, make_parts, max_workers=8, cache=None):
+    """
+    Build parts of file_path with make_parts(out_dir), upload them and write a manifest.
+
+    With an upload cache, a source file whose hash, manifest and parts are
+    all unchanged in S3 is skipped without being split or converted at all.
+    """
+    destination = f"{bucket_name}/{prefix}"
+    if cache is not None:
+        file_md5 = file_hash(file_path)
+        entry = cache["files"].get(destination, {})
+        parts = [(key, cache["parts"].get(f"{bucket_name}/{key}", {}).get("md5")) for key in entry.get("keys", [])]
+        if (entry.get("md5") == file_md5 and entry.get("manifest") == manifest_key and
+                all(remote_matches(s3_client, bucket_name, key, md5, cache) for key, md5 in parts)):
+            print(f"{os.path.basename(file_path)} is unchanged since its last upload, skipping.")
+            return f"s3://{bucket_name}/{manifest_key}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        part_paths = make_parts(tmp_dir)
+        keys = upload_parts(s3_client, bucket_name, part_paths, prefix, max_workers, cache)
+    manifest = write_manifest(s3_client, bucket_name, manifest_key, keys)
+    if cache is not None:
+        cache["files"][destination] = {"md5": file_md5, "manifest": manifest_key, "keys": keys}
+    return manifest
+
+
+def upload_sliced(s3_client, bucket_name, file_path, prefix, num_parts, max_workers=8, cache=None, part_bytes=None):
+    """
+    Compress, split and upload a CSV file in parallel, then write its manifest.
+
+    Returns the s3:// URL of the manifest at manifests/<prefix>/<name>.manifest.
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+
+    def make_parts(tmp_dir):
+        print(f"Splitting {os.path.basename(file_path)} into gzip parts...")
+        return split_and_compress(file_path, num_parts, tmp_dir, part_bytes)
+
+    return upload_cached(s3_client, bucket_name, file_path, prefix, manifest_key_for(prefix, name),
+                         make_parts, max_workers, cache)
+
+
+def upload_parquet(s3_client, bucket_name, table_name, file_path, prefix, num_parts, max_workers=8, cache=None):
+    """
+    Convert a CSV into num_parts Parquet files, upload them and write a manifest.
+
+    Returns the s3:// URL of the manifest at manifests/<prefix>/<name>.parquet.manifest.
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+
+    def make_parts(tmp_dir):
+        print(f"Converting {os.path.basename(file_path)} into {num_parts} Parquet files...")
+        return csv_to_parquet(table_name, file_path, tmp_dir, num_parts)
+
+    return upload_cached(s3_client, bucket_name, file_path, prefix, manifest_key_for(prefix, f"{name}.parquet"),
+                         make_parts, max_workers, cache)
+
+
+def upload_partitioned(s3_client, bucket_name, file_path, prefix, catalogue_path, max_workers=8):
+    """
+    Upload an event log as year=/month=/day= partitions, skipping unchanged days.
+
+    Partitions whose content changed since their last upload are sent, as
+    are unchanged ones S3 no longer holds (e.g. after the bucket was
+    recreated). Two manifests are then written under manifests/<prefix>/:
+    pending.manifest with every partition not yet loaded, recorded in the
+    catalogue for ETL.load_staging_tables, and all.manifest with every
+    partition, which create_tables makes pending again when it recreates
+    the tables. Returns the pending manifest URL, or None if nothing is
+    pending.
+    """
+    local_dir = os.path.join(os.path.dirname(catalogue_path), prefix)
+    catalogue = update_catalogue(load_catalogue(catalogue_path), partition_events(file_path, local_dir), prefix)
+    entries = catalogue["partitions"]
+    changed = pending_partitions(catalogue, "uploaded")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Partitions uploaded before their MD5 was kept as metadata are sent once more
+        unchanged = sorted(set(entries) - set(changed))
+        remote = executor.map(
+            lambda name: remote_matches(s3_client, bucket_name, entries[name]["key"], entries[name]["hash"],
+                                        {"parts": {}}),
+            unchanged
+        )
+        missing = [name for name, etag in zip(unchanged, remote) if etag is None]
+        futures = {
+            executor.submit(
+                s3_client.upload_file, entries[name]["path"], bucket_name, entries[name]["key"],
+                ExtraArgs={"Metadata": {MD5_METADATA: entries[name]["hash"]}}, Config=TRANSFER_CONFIG
+            ): name
+            for name in changed + missing
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except ClientError as e:
+                print(f"Error uploading partition {futures[future]}: {e}")
+                save_catalogue(catalogue, catalogue_path)
+                raise
+            mark_partitions(catalogue, [futures[future]], "uploaded")
+    print(f"Uploaded {len(futures)} of {len(entries)} partitions to {prefix}/ in {bucket_name}" +
+          (f", {len(missing)} of them unchanged but missing from S3." if missing else "."))
+
+    sizes = {entry["key"]: entry["bytes"] for entry in entries.values()}
+    names = sorted(entries)
+    catalogue["full_manifest"] = write_manifest(
+        s3_client, bucket_name, manifest_key_for(prefix, "all"), [entries[name]["key"] for name in names], sizes
+    ) if names else None
+    catalogue["full_manifest_partitions"] = names
+
+    pending = pending_partitions(catalogue, "loaded")
+    catalogue["manifest"] = None
+    if pending:
+        keys = [entries[name]["key"] for name in pending]
+        catalogue["manifest"] = write_manifest(s3_client, bucket_name, manifest_key_for(prefix, "pending"),
+                                               keys, sizes)
+    catalogue["manifest_partitions"] = pending
+    save_catalogue(catalogue, catalogue_path)
+    return catalogue["manifest"]
+
+
+# Bucket and local files uploaded by main() and by the cluster bring-up
+S3_BUCKET_NAME = "udacity-data-engineering-rohit1998"
+REGION = "us-west-2"
+DATA_DIR = "./data"  # Local directory containing events.csv and songs.csv
+
+
+def stage_data(config, s3_client, bucket_name=S3_BUCKET_NAME, region=REGION):
+    """
+    Validate, create the bucket and upload the event and song data.
+
+    Returns {staging table: manifest URL} for the non-partitioned uploads,
+    ready to use as EVENT_SOURCE/SONGS_SOURCE in dwh.cfg.
+    """
     files_to_upload = {
-        "events_data/events.csv": os.path.join(DATA_DIR, "events.csv"),
-        "songs_data/songs.csv": os.path.join(DATA_DIR, "songs.csv")
+        "events_data": os.path.join(DATA_DIR, "events.csv"),
+        "songs_data": os.path.join(DATA_DIR, "songs.csv")
+    }
+    staging_tables = {
+        "events_data": "staging_events",
+        "songs_data": "staging_songs"
+    }
+    num_parts = config.getint("UPLOAD", "NUM_PARTS", fallback=0) or default_num_parts(config)
+    max_workers = config.getint("UPLOAD", "MAX_WORKERS", fallback=8)
+    upload_format = config.get("UPLOAD", "FORMAT", fallback="csv").lower()
+    catalogue_path = config.get("UPLOAD", "PARTITION_CATALOGUE", fallback="")
+    part_bytes = int(config.getfloat("UPLOAD", "PART_SIZE_MB", fallback=0) * 1024 * 1024) or None
+    cache_path = config.get("UPLOAD", "CACHE_PATH", fallback="")
+    cache = load_upload_cache(cache_path) if cache_path else None
+
+    # Validate before upload so bad rows land in a reject file instead of
+    # being dropped silently by MAXERROR/TRUNCATECOLUMNS during COPY
+    if config.getboolean("UPLOAD", "VALIDATE", fallback=False):
+        validated_dir = os.path.join(DATA_DIR, "validated")
+        os.makedirs(validated_dir, exist_ok=True)
+        for prefix, file_path in files_to_upload.items():
+            files_to_upload[prefix] = validate_csv(
+                staging_tables[prefix], file_path,
+                clean_file=os.path.join(validated_dir, os.path.basename(file_path)),
+                reject_file=os.path.join(validated_dir, os.path.basename(file_path) + ".rejects")
+            )[0]
+
+    # Create S3 bucket
+    create_s3_bucket(s3_client, bucket_name, region)
+
+    # Upload files to S3 as compressed parts with a COPY manifest each
+    sources = {}
+    try:
+        for prefix, file_path in files_to_upload.items():
+            if catalogue_path and staging_tables[prefix] == "staging_events":
+                # Loaded through the partition catalogue rather than EVENT_SOURCE
+                upload_partitioned(s3_client, bucket_name, file_path, prefix, catalogue_path, max_workers)
+                continue
+            if upload_format == "parquet":
+                manifest = upload_parquet(s3_client, bucket_name, staging_tables[prefix], file_path, prefix,
+                                          num_parts, max_workers, cache)
+            else:
+                manifest = upload_sliced(s3_client, bucket_name, file_path, prefix, num_parts, max_workers,
+                                         cache, part_bytes)
+            sources[staging_tables[prefix]] = manifest
+    finally:
+        # Keep the record of whatever did upload, even if a later file failed
+        if cache is not None:
+            save_json(cache, cache_path)
+    return sources
+
+
+def source_settings(config, sources):
+    """
+    Return the dwh.cfg [S3] settings for what stage_data uploaded: the
+    manifest of each staging table and, with partitioned events, the
+    partition catalogue.
+    """
+    settings = {
+        key: f"'{sources[table]}'"
+        for key, table in (("EVENT_SOURCE", "staging_events"), ("SONGS_SOURCE", "staging_songs"))
+        if table in sources
     }
+    catalogue_path = config.get("UPLOAD", "PARTITION_CATALOGUE", fallback="")
+    if catalogue_path:
+        settings["PARTITION_CATALOGUE"] = catalogue_path
+    return settings
+
+
+def main(dwh_config_file='dwh.cfg'):
+    """Upload the data as configured in dwh2.cfg and point dwh_config_file's [S3] sources at it."""
+    # Load configuration
+    config = load_config('dwh2.cfg')
 
     # Initialize S3 client
     s3_client = boto3.client(
         's3',
-        region_name=aws_config["REGION"],
-        aws_access_key_id=aws_config["KEY"],
-        aws_secret_access_key=aws_config["SECRET"]
+        region_name=REGION,
+        aws_access_key_id=config.get('AWS', 'KEY'),
+        aws_secret_access_key=config.get('AWS', 'SECRET')
     )
-
-    # Create S3 bucket
-    create_s3_bucket(s3_client, S3_BUCKET_NAME, aws_config["REGION"])
-
-    # Upload files to S3
-    for s3_key, file_path in files_to_upload.items():
-        upload_file_to_s3(s3_client, S3_BUCKET_NAME, file_path, s3_key)
+    sources = stage_data(config, s3_client)
+    update_config_file(dwh_config_file, {"S3": source_settings(config, sources)})
+    print(f"Wrote staging sources to {dwh_config_file}")
 
 
 if __name__ == "__main__":
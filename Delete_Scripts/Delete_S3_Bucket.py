@@ -1,6 +1,11 @@
 import boto3
 import configparser
+import time
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
 
 
 def load_config(config_file):
@@ -10,18 +15,98 @@ def load_config(config_file):
     return config
 
 
-def delete_objects_from_s3_bucket(s3_client, bucket_name):
-    """Delete all objects from an S3 bucket."""
+def list_object_batches(s3_client, bucket_name, batch_size=DELETE_BATCH_SIZE):
+    """
+    Yield every object version and delete marker in the bucket in batches.
+
+    list_object_versions also returns the objects of unversioned buckets
+    (with version "null"), so one paginated listing finds everything that
+    would stop delete_bucket.
+    """
+    batch = []
+    for page in s3_client.get_paginator("list_object_versions").paginate(Bucket=bucket_name):
+        for entry in page.get("Versions", []) + page.get("DeleteMarkers", []):
+            batch.append({"Key": entry["Key"], "VersionId": entry["VersionId"]})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def delete_batch(s3_client, bucket_name, batch, attempts=3):
+    """
+    Delete up to 1000 keys with one delete_objects call.
+
+    Keys S3 reports as failed (e.g. SlowDown) are retried with backoff.
+    Returns (deleted, errors) where errors are the entries still failing.
+    """
+    deleted, errors = 0, []
+    for attempt in range(attempts):
+        response = s3_client.delete_objects(Bucket=bucket_name, Delete={"Objects": batch, "Quiet": True})
+        errors = response.get("Errors", [])
+        deleted += len(batch) - len(errors)
+        if not errors:
+            break
+        batch = [{"Key": e["Key"], "VersionId": e["VersionId"]} for e in errors if "VersionId" in e]
+        time.sleep(2 ** attempt)
+    return deleted, errors
+
+
+def abort_multipart_uploads(s3_client, bucket_name):
+    """Abort unfinished multipart uploads, whose parts are stored (and billed) until then."""
+    aborted = 0
+    for page in s3_client.get_paginator("list_multipart_uploads").paginate(Bucket=bucket_name):
+        for upload in page.get("Uploads", []):
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=upload["Key"], UploadId=upload["UploadId"])
+            aborted += 1
+    if aborted:
+        print(f"Aborted {aborted} unfinished multipart uploads.")
+    return aborted
+
+
+def delete_objects_from_s3_bucket(s3_client, bucket_name, max_workers=16):
+    """
+    Delete all objects, versions and delete markers from an S3 bucket.
+
+    Keys are listed page by page and deleted in 1000-key batches on a thread
+    pool while listing continues; only a bounded number of batches is held
+    in memory. The bucket is listed again until a pass finds nothing, so
+    keys written during teardown are caught too. Raises RuntimeError if any
+    key could not be deleted.
+    """
     try:
         print(f"Deleting all objects from the bucket: {bucket_name}")
-        objects = s3_client.list_objects_v2(Bucket=bucket_name)
-        if "Contents" in objects:
-            for obj in objects["Contents"]:
-                print(f"Deleting object: {obj['Key']}")
-                s3_client.delete_object(Bucket=bucket_name, Key=obj["Key"])
-            print("All objects deleted successfully.")
+        abort_multipart_uploads(s3_client, bucket_name)
+        start = time.perf_counter()
+        total = 0
+        while True:
+            deleted, errors = 0, []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                running = set()
+                for batch in list_object_batches(s3_client, bucket_name):
+                    if len(running) >= 2 * max_workers:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            count, failed = future.result()
+                            deleted, errors = deleted + count, errors + failed
+                    running.add(executor.submit(delete_batch, s3_client, bucket_name, batch))
+                for future in running:
+                    count, failed = future.result()
+                    deleted, errors = deleted + count, errors + failed
+
+            if errors:
+                raise RuntimeError(f"{len(errors)} keys could not be deleted, first: {errors[:3]}")
+            total += deleted
+            if not deleted:
+                break
+
+        seconds = time.perf_counter() - start
+        if total:
+            print(f"Deleted {total} objects in {seconds:.1f}s ({total / max(seconds, 1e-9):.0f} objects/s).")
         else:
             print("No objects to delete.")
+        return total
     except ClientError as e:
         print(f"Error deleting objects from bucket: {e}")
         raise
@@ -61,7 +146,8 @@ def main():
     )
 
     # Delete all objects from the bucket
-    delete_objects_from_s3_bucket(s3_client, S3_BUCKET_NAME)
+    delete_objects_from_s3_bucket(s3_client, S3_BUCKET_NAME,
+                                  config.getint('TEARDOWN', 'MAX_WORKERS', fallback=16))
 
     # Delete the S3 bucket
     delete_s3_bucket(s3_client, S3_BUCKET_NAME)
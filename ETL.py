@@ -1,91 +1,336 @@
-import configparser
-import psycopg2
+import os
 import pandas as pd
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dag_scheduler import run_dag, wlm_slot_count
+from db_session import close_all, get_manager, load_config
+from instrumentation import configure, execute_statement, write_prometheus
+from maintenance import run_maintenance
+from partitions import load_catalogue, mark_partitions, pending_partitions, save_catalogue
+from query_service import notify_load_finished
 
 # Define SQL queries for COPY and INSERT operations
-from sql_queries import insert_table_queries
+from sql_queries import (
+    aggregate_rebuild_queries,
+    clear_staging_tables,
+    insert_table_graph,
+    incremental_insert_tables,
+    load_watermark_select,
+    load_watermark_update,
+)
+
+COMPRESSION_SUFFIXES = {".gz": "GZIP", ".gzip": "GZIP", ".zst": "ZSTD", ".zstd": "ZSTD"}
+
 
-def load_staging_tables(cur, conn, config):
+def detect_compression(source, setting="AUTO"):
     """
-    Load data into staging tables from S3.
+    Return the COPY compression keyword for a source URL.
+
+    AUTO looks at the file suffix (ignoring a trailing .manifest). Manifests
+    and key prefixes without a recognisable suffix are assumed to hold the
+    gzip parts written by Create_S3_Buckets.upload_sliced.
     """
-    DWH_ROLE_ARN = config['IAM_ROLE']['ARN']
-    S3_EVENT_CSV = config['S3']['EVENT_CSV']
-    S3_SONGS_CSV = config['S3']['SONGS_CSV']
-
-    queries = [
-        f"""
-            COPY staging_events
-            FROM {S3_EVENT_CSV}
-            IAM_ROLE {DWH_ROLE_ARN}
-            CSV
-            IGNOREHEADER 1
-            FILLRECORD
-            TRUNCATECOLUMNS
-            MAXERROR 10;
-        """,
-        f"""
-            COPY staging_songs
-            FROM {S3_SONGS_CSV}
-            IAM_ROLE {DWH_ROLE_ARN}
+    if setting.upper() != "AUTO":
+        return "" if setting.upper() == "NONE" else setting.upper()
+    path = source.strip("'\"")
+    if path.endswith(".manifest"):
+        path = path[:-len(".manifest")]
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in COMPRESSION_SUFFIXES:
+        return COMPRESSION_SUFFIXES[suffix]
+    return "" if suffix == ".csv" else "GZIP"
+
+
+def is_parquet_source(source, data_format="AUTO"):
+    """Return True if source should be loaded with FORMAT AS PARQUET."""
+    if data_format.upper() != "AUTO":
+        return data_format.upper() == "PARQUET"
+    path = source.strip("'\"")
+    if path.endswith(".manifest"):
+        path = path[:-len(".manifest")]
+    return path.endswith(".parquet")
+
+
+def build_copy_query(table, source, role_arn, compression="AUTO", data_format="AUTO"):
+    """
+    Build a staging COPY for a single file, a manifest or a key prefix.
+
+    Automatic compression analysis and statistics are switched off; staging
+    tables are truncated and reloaded every run, so both are wasted work.
+    Parquet sources carry their own schema and compression, so none of the
+    CSV parsing options apply to them.
+    """
+    manifest = "MANIFEST" if source.strip("'\"").endswith(".manifest") else ""
+    if is_parquet_source(source, data_format):
+        return f"""
+            COPY {table}
+            FROM {source}
+            IAM_ROLE {role_arn}
+            {manifest}
+            FORMAT AS PARQUET
+            COMPUPDATE OFF
+            STATUPDATE OFF;
+        """
+    return f"""
+            COPY {table}
+            FROM {source}
+            IAM_ROLE {role_arn}
+            {manifest}
             CSV
             IGNOREHEADER 1
+            {detect_compression(source, compression)}
             FILLRECORD
             TRUNCATECOLUMNS
-            MAXERROR 10;
+            MAXERROR 10
+            COMPUPDATE OFF
+            STATUPDATE OFF;
         """
-    ]
 
-    for query in queries:
-        try:
+
+def run_copy(manager, table, query):
+    """
+    Empty a staging table and COPY into it in one transaction, on its own
+    pooled connection so loads can proceed in parallel. With no query the
+    table is only emptied. Returns the error, if any, instead of raising so
+    the other load finishes.
+    """
+    try:
+        with manager.session() as (cur, conn):
+            execute_statement(cur, conn, "copy", f"clear_{table}", clear_staging_tables[table], commit=False)
+            if query is None:
+                conn.commit()
+                return None
             print(f"Executing query: {query}")
-            cur.execute(query)
-            conn.commit()
-        except Exception as e:
-            print(f"Error executing query: {e}")
+            execute_statement(cur, conn, "copy", table, query, copy=True)
+    except Exception as e:
+        print(f"Error executing query: {e}")
+        return e
+    return None
+
+
+def staging_copy_queries(config):
+    """
+    Build the staging COPYs from the [S3] settings.
+
+    EVENT_SOURCE/SONGS_SOURCE may name a manifest or a key prefix of many
+    compressed CSV or Parquet parts; EVENT_CSV/SONGS_CSV are used when they
+    are not set. With a PARTITION_CATALOGUE, staging_events is instead loaded
+    from only the daily partitions not loaded yet, read through the manifest
+    Create_S3_Buckets wrote for them, and has no COPY if none are pending.
+    Returns ({table: query}, pending partitions).
+    """
+    DWH_ROLE_ARN = config['IAM_ROLE']['ARN']
+    compression = config.get('S3', 'COMPRESSION', fallback='AUTO')
+    data_format = config.get('S3', 'FORMAT', fallback='AUTO')
+    S3_EVENT_SOURCE = config.get('S3', 'EVENT_SOURCE', fallback='') or config['S3']['EVENT_CSV']
+    S3_SONGS_SOURCE = config.get('S3', 'SONGS_SOURCE', fallback='') or config['S3']['SONGS_CSV']
+
+    queries = {
+        "staging_events": build_copy_query("staging_events", S3_EVENT_SOURCE, DWH_ROLE_ARN, compression, data_format),
+        "staging_songs": build_copy_query("staging_songs", S3_SONGS_SOURCE, DWH_ROLE_ARN, compression, data_format),
+    }
+
+    partitions = []
+    catalogue_path = config.get('S3', 'PARTITION_CATALOGUE', fallback='')
+    if catalogue_path:
+        if not os.path.exists(catalogue_path):
+            raise RuntimeError(f"No partition catalogue at {catalogue_path}; run Create_S3_Buckets.py "
+                               "with the same [UPLOAD] PARTITION_CATALOGUE first")
+        catalogue = load_catalogue(catalogue_path)
+        partitions = pending_partitions(catalogue, "loaded")
+        if partitions and not set(partitions) <= set(catalogue.get("manifest_partitions", [])):
+            raise RuntimeError(f"{catalogue_path} has no manifest for the pending partitions; "
+                               "run Create_S3_Buckets.py first")
+        if partitions:
+            print(f"Loading {len(partitions)} pending partitions: {', '.join(partitions)}")
+            queries["staging_events"] = build_copy_query(
+                "staging_events", f"'{catalogue['manifest']}'", DWH_ROLE_ARN, "GZIP", "CSV")
+        else:
+            print("No new or changed event partitions to load.")
+            del queries["staging_events"]
+    return queries, partitions
+
+
+def mark_partitions_loaded(config, partitions):
+    """
+    Record in the partition catalogue that partitions reached the analytics
+    tables, and drop them from the pending manifest's partition list.
+    """
+    if not partitions:
+        return
+    catalogue_path = config['S3']['PARTITION_CATALOGUE']
+    catalogue = mark_partitions(load_catalogue(catalogue_path), partitions, "loaded")
+    catalogue["manifest_partitions"] = [
+        name for name in catalogue.get("manifest_partitions", []) if name not in set(partitions)
+    ]
+    if not catalogue["manifest_partitions"]:
+        catalogue["manifest"] = None
+    save_catalogue(catalogue, catalogue_path)
+    print(f"Marked {len(partitions)} partitions as loaded.")
+
+
+def load_staging_tables(config, manager=None):
+    """
+    Replace the contents of the staging tables with the current sources.
+
+    See staging_copy_queries for the sources. Each table is emptied in the
+    same transaction as its COPY, so it never holds rows from an earlier
+    run, and staging_events is left empty when no partitions are pending.
+    Both loads run concurrently on separate pooled connections; if either
+    fails a RuntimeError is raised once both have finished. Returns the
+    partitions staged.
+    """
+    manager = manager or get_manager(config)
+    queries, partitions = staging_copy_queries(config)
+    queries = {table: queries.get(table) for table in clear_staging_tables}
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        errors = dict(zip(queries, executor.map(lambda item: run_copy(manager, *item), queries.items())))
+
+    failed = [table for table, error in errors.items() if error is not None]
+    if failed:
+        raise RuntimeError(f"COPY failed for {', '.join(failed)}")
+    return partitions
 
 
 def insert_tables(cur, conn):
     """
     Insert data into analytics tables from staging tables.
+    Returns True if every insert succeeded.
     """
-    for query in insert_table_queries:
+    succeeded = True
+    for name, (query, _) in insert_table_graph.items():
         try:
-            cur.execute(query)
-            conn.commit()
+            rows = execute_statement(cur, conn, "insert", name, query)
             print(f"Query executed successfully: {query}")
-            print(f"Number of rows inserted: {cur.rowcount}")
+            print(f"Number of rows inserted: {rows}")
         except Exception as e:
             print(f"Error executing query: {e}")
+            succeeded = False
+    return succeeded
+
+
+def insert_tables_concurrent(cur, manager):
+    """
+    Insert data into analytics tables, running independent inserts in parallel.
+
+    Statements follow the dependency graph in sql_queries.insert_table_graph
+    on pooled connections, as many at once as the cluster's WLM slot count
+    allows. One pooled connection is left for the caller's cursor.
+    """
+    slots = max(1, min(wlm_slot_count(cur), len(insert_table_graph), manager.maxconn - 1))
+    start = time.perf_counter()
+    results = run_dag(insert_table_graph, manager, slots)
+    print(f"Inserts finished in {time.perf_counter() - start:.2f}s on {slots} connections.")
+    return results
 
 
-def main():
+def insert_tables_incremental(cur, conn, source, tables=None):
     """
-    Main function to manage the ETL pipeline.
+    Insert only staging rows beyond the persisted high-water mark for source.
+
+    staging_events holds only this run's load (see load_staging_tables),
+    and with a PARTITION_CATALOGUE only the days not loaded before, so the
+    work follows the amount of new data rather than the history. All
+    inserts and the watermark update run in a single transaction so a
+    failed run leaves the watermark untouched and can simply be repeated.
+    tables limits the run to some of incremental_insert_tables by name.
+    Returns True if the transaction committed.
+    """
+    params = {"source": source}
+    tables = tables or list(incremental_insert_tables)
+    try:
+        cur.execute(load_watermark_select, params)
+        print(f"Current watermark for {source}: {cur.fetchone()[0]}")
+
+        for name in tables:
+            query = incremental_insert_tables[name]
+            rows = execute_statement(cur, conn, "insert_incremental", name, query, params, commit=False)
+            print(f"Query executed successfully: {query}")
+            print(f"Number of rows inserted: {rows}")
+
+        advanced = execute_statement(cur, conn, "insert_incremental", "load_watermark",
+                                     load_watermark_update, params, commit=False)
+        conn.commit()
+        print(f"Watermark advanced for {source}." if advanced else f"No new rows for {source}.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error executing incremental load, rolled back: {e}")
+        return False
+    return True
+
+
+def rebuild_aggregates(cur, conn):
+    """
+    Recompute every bucket of every aggregate table from songplay, for the
+    first build or after songplay has been reloaded. Returns True on success.
+    """
+    succeeded = True
+    for name, query in aggregate_rebuild_queries.items():
+        try:
+            rows = execute_statement(cur, conn, "aggregate", name, query)
+            print(f"Rebuilt {name}: {rows} rows")
+        except Exception as e:
+            print(f"Error rebuilding {name}: {e}")
+            succeeded = False
+    return succeeded
+
+
+def main(config_file='dwh.cfg'):
+    """
+    Main function to manage the ETL pipeline configured in config_file;
+    --rebuild-aggregates only recomputes the aggregate tables.
     """
     # Load configuration
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
+    config = load_config(config_file)
+    configure(config)
+
+    if "--rebuild-aggregates" in sys.argv[1:]:
+        with get_manager(config).session() as (cur, conn):
+            rebuild_aggregates(cur, conn)
+        notify_load_finished(config)
+        close_all()
+        write_prometheus()
+        return
+
+    # Every stage borrows connections from one shared pool
+    manager = get_manager(config)
+    with manager.session() as (cur, conn):
+        print("Database connection established.")
+
+        # Load data into staging tables
+        print("Loading data into staging tables...")
+        partitions = load_staging_tables(config, manager)
 
-    # Establish database connection
-    conn = psycopg2.connect(
-        "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
-    )
-    cur = conn.cursor()
+        # Insert data into final tables
+        print("Inserting data into analytics tables...")
+        if config.getboolean('ETL', 'INCREMENTAL', fallback=False):
+            source = config.get('S3', 'EVENT_SOURCE', fallback='') or config['S3']['EVENT_CSV']
+            succeeded = insert_tables_incremental(cur, conn, source)
+        elif config.getboolean('ETL', 'CONCURRENT_INSERTS', fallback=False):
+            results = insert_tables_concurrent(cur, manager)
+            succeeded = all(result["status"] == "ok" for result in results.values())
+        else:
+            succeeded = insert_tables(cur, conn)
 
-    print("Database connection established.")
+        # Partitions count as loaded only once their rows reached the analytics tables
+        if succeeded:
+            mark_partitions_loaded(config, partitions)
 
-    # Load data into staging tables
-    print("Loading data into staging tables...")
-    load_staging_tables(cur, conn, config)
+    # Cached dashboard results are stale once new rows have been inserted
+    notify_load_finished(config)
 
-    # Insert data into final tables
-    print("Inserting data into analytics tables...")
-    insert_tables(cur, conn)
+    # Re-sort and re-analyze the tables the load left unsorted or with stale statistics
+    if succeeded and config.getboolean('MAINTENANCE', 'AFTER_LOAD', fallback=False):
+        print("Running table maintenance...")
+        run_maintenance(config, manager)
 
-    # Close the connection
-    conn.close()
-    print("Database connection closed.")
+    # Close the connections
+    close_all()
+    print("Database connections closed.")
+    write_prometheus()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from dag_scheduler import run_statement
+from db_session import close_all, get_manager, load_config
+from generate_data import generate
+from local_loader import load_csv_to_staging
+from sql_queries import create_table_queries, drop_table_queries, insert_table_graph
+
+# PostgreSQL has no FNV_HASH; this 64-bit stand-in lets the Redshift SQL in
+# sql_queries run unchanged against a local database.
+postgres_compat_setup = ("""
+    CREATE OR REPLACE FUNCTION fnv_hash(value text, seed bigint DEFAULT 0)
+    RETURNS bigint AS $$ SELECT hashtextextended(value, seed) $$
+    LANGUAGE sql IMMUTABLE;
+""")
+
+
+def timed(stages, name, func, *args, **kwargs):
+    """Run func, record its wall time (and row count if it returns one) under name."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    rows = result if isinstance(result, int) else None
+    stages[name] = {"seconds": round(seconds, 4), "rows": rows}
+    print(f"{name}: {seconds:.2f}s" + (f", {rows} rows" if rows is not None else ""))
+    return result
+
+
+def upload_stage(bench, paths):
+    """Upload generated parts to a local S3 stand-in; returns the part count."""
+    import boto3
+    from Create_S3_Buckets import upload_parts
+
+    s3_client = boto3.client('s3', endpoint_url=bench['S3_ENDPOINT_URL'], region_name='us-east-1')
+    bucket_name = bench.get('S3_BUCKET', 'benchmark')
+    existing = [bucket['Name'] for bucket in s3_client.list_buckets().get('Buckets', [])]
+    if bucket_name not in existing:
+        s3_client.create_bucket(Bucket=bucket_name)
+    return len(upload_parts(s3_client, bucket_name, paths, 'benchmark', int(bench.get('UPLOAD_WORKERS', '8'))))
+
+
+def reset_tables(cur, conn):
+    """Drop and recreate every table, plus the PostgreSQL compatibility shims."""
+    cur.execute(postgres_compat_setup)
+    for query in drop_table_queries + create_table_queries:
+        cur.execute(query)
+    conn.commit()
+
+
+def copy_stage(cur, conn, table_name, paths):
+    """Stream every part into a staging table; returns the rows loaded."""
+    return sum(load_csv_to_staging(table_name, path, cur, conn)[0] for path in paths)
+
+
+def git_commit():
+    """Return the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(current, baseline, tolerance):
+    """Return the stages that got more than tolerance (a fraction) slower than baseline."""
+    regressions = []
+    for name, stage in current["stages"].items():
+        before = baseline["stages"].get(name)
+        if before and before["seconds"] > 0 and stage["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append((name, before["seconds"], stage["seconds"]))
+            print(f"REGRESSION {name}: {before['seconds']:.2f}s -> {stage['seconds']:.2f}s")
+    return regressions
+
+
+def run_benchmark(config):
+    """
+    Time every pipeline stage against the database in config's [CLUSTER].
+
+    Stages are data generation, the optional upload to a local S3 stand-in
+    (when S3_ENDPOINT_URL is set), the staging loads, and each statement in
+    sql_queries.insert_table_graph. Returns the result document.
+    """
+    bench = config['BENCHMARK']
+    stages = {}
+
+    song_parts, event_parts = timed(stages, "generate", generate, config)
+    if bench.get('S3_ENDPOINT_URL'):
+        timed(stages, "upload", upload_stage, bench, song_parts + event_parts)
+
+    manager = get_manager(config)
+    with manager.session() as (cur, conn):
+        reset_tables(cur, conn)
+        timed(stages, "copy_staging_songs", copy_stage, cur, conn, "staging_songs", song_parts)
+        timed(stages, "copy_staging_events", copy_stage, cur, conn, "staging_events", event_parts)
+
+    for name, (query, _) in insert_table_graph.items():
+        seconds, rows = run_statement(manager, query, name=name)
+        stages[f"insert_{name}"] = {"seconds": round(seconds, 4), "rows": rows}
+        print(f"insert_{name}: {seconds:.2f}s, {rows} rows")
+    close_all()
+
+    return {
+        "run_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "scale": {key: value for key, value in bench.items() if key.upper() in
+                  ("EVENTS", "SONGS", "ARTISTS", "USERS", "SONG_SKEW", "USER_SKEW", "SESSION_LENGTH", "DAYS")},
+        "stages": stages,
+    }
+
+
+def main():
+    """
+    Run the benchmark configured in benchmark.cfg, save the result as JSON
+    and exit non-zero if any stage regressed against BASELINE.
+    """
+    config = load_config('benchmark.cfg')
+    bench = config['BENCHMARK']
+    results = run_benchmark(config)
+
+    results_dir = bench.get('RESULTS_DIR', 'benchmarks')
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"benchmark-{results['run_at'][:19].replace(':', '')}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+    baseline = bench.get('BASELINE') or None
+    if baseline is None:
+        previous = sorted(set(glob.glob(os.path.join(results_dir, "benchmark-*.json"))) - {path})
+        baseline = previous[-1] if previous else None
+    if baseline:
+        with open(baseline) as f:
+            if compare_results(results, json.load(f), float(bench.get('TOLERANCE', '0.2'))):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
-import configparser
-import psycopg2
+import os
+import re
+
+from db_session import close_all, get_manager, load_config
+from instrumentation import configure, execute_statement, write_prometheus
+from partitions import load_catalogue, reset_partitions, save_catalogue
 from sql_queries import create_table_queries, drop_table_queries
+from table_layout import analyze_compression, layout_create_table_queries
+
+
+def table_name(query):
+    """Return the table a DROP/CREATE TABLE statement acts on."""
+    return re.search(r"TABLE (?:IF (?:NOT )?EXISTS )?(\w+)", query).group(1)
 
 
 def drop_tables(cur, conn):
@@ -11,57 +21,74 @@ def drop_tables(cur, conn):
     for query in drop_table_queries:
         try:
             print(f"Executing drop query: {query}")
-            cur.execute(query)
-            conn.commit()
+            execute_statement(cur, conn, "drop", table_name(query), query)
             print("Table dropped successfully.")
         except Exception as e:
             print(f"Error dropping table: {e}")
     print("Finished dropping tables.\n")
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, queries=create_table_queries):
     """
     Create tables in the database.
     """
     print("Creating tables...")
-    for query in create_table_queries:
+    for query in queries:
         try:
             print(f"Executing create query: {query}")
-            cur.execute(query)
-            conn.commit()
+            execute_statement(cur, conn, "create", table_name(query), query)
             print("Table created successfully.")
         except Exception as e:
             print(f"Error creating table: {e}")
     print("Finished creating tables.\n")
 
 
+def reset_loaded_partitions(config):
+    """
+    Mark every partition in the [S3] PARTITION_CATALOGUE as not loaded, as the
+    tables holding them were just dropped. The pending manifest becomes the
+    manifest of all partitions Create_S3_Buckets.py last uploaded.
+    """
+    catalogue_path = config.get('S3', 'PARTITION_CATALOGUE', fallback='')
+    if not catalogue_path or not os.path.exists(catalogue_path):
+        return
+    catalogue = reset_partitions(load_catalogue(catalogue_path), "loaded")
+    catalogue["manifest"] = catalogue.get("full_manifest")
+    catalogue["manifest_partitions"] = catalogue.get("full_manifest_partitions", [])
+    save_catalogue(catalogue, catalogue_path)
+    print(f"Marked {len(catalogue['partitions'])} partitions in {catalogue_path} as not loaded.")
+
 
-def main():
+def main(config_file='dwh.cfg'):
     """
     Main function to set up the database by dropping existing tables
-    and creating new ones.
+    and creating new ones, using the cluster in config_file.
     """
     # Load configuration
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
+    config = load_config(config_file)
+    configure(config)
 
-    # Establish connection to the database
-    conn = psycopg2.connect(
-        "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
-    )
-    cur = conn.cursor()
+    # Borrow a connection from the shared pool
+    with get_manager(config).session() as (cur, conn):
+        # Print connection details for debugging
+        print("Connection established:", conn)
+        print("Cursor created:", cur)
 
-    # Print connection details for debugging
-    print("Connection established:", conn)
-    print("Cursor created:", cur)
+        # Profile the staging data still in place before it is dropped, so
+        # the new tables get distribution, sort keys and encodings
+        queries = create_table_queries
+        if config.getboolean('TABLES', 'APPLY_LAYOUT', fallback=False):
+            queries = layout_create_table_queries(analyze_compression(conn))
 
-    # Drop and recreate tables
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+        # Drop and recreate tables
+        drop_tables(cur, conn)
+        create_tables(cur, conn, queries)
+    reset_loaded_partitions(config)
 
-    # Close the connection
-    conn.close()
+    # Close the connections
+    close_all()
     print("Connection closed.")
+    write_prometheus()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from instrumentation import execute_statement
+
+# Total concurrency of the user-defined WLM queues (manual WLM uses
+# service classes 6-13). Auto WLM has no fixed slot count.
+wlm_slot_count_query = """
+    SELECT SUM(num_query_tasks)
+    FROM stv_wlm_service_class_config
+    WHERE service_class BETWEEN 6 AND 13;
+"""
+
+
+def wlm_slot_count(cur, default=5):
+    """Return the number of WLM query slots, or default if unavailable."""
+    try:
+        cur.execute(wlm_slot_count_query)
+        slots = cur.fetchone()[0]
+    except Exception as e:
+        cur.connection.rollback()
+        print(f"Could not read WLM slot count, using {default}: {e}")
+        return default
+    return int(slots) if slots else default
+
+
+def validate_graph(graph):
+    """Raise ValueError if a dependency is undeclared or the graph has a cycle."""
+    for name, (_, depends_on) in graph.items():
+        missing = set(depends_on) - set(graph)
+        if missing:
+            raise ValueError(f"{name} depends on undeclared statements: {sorted(missing)}")
+
+    remaining = {name: set(depends_on) for name, (_, depends_on) in graph.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Dependency cycle between: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def run_statement(pool, query, params=None, name="statement", stage="insert"):
+    """Execute, commit and record one statement on a pooled connection."""
+    conn = pool.getconn()
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cur:
+            rows = execute_statement(cur, conn, stage, name, query, params)
+        return time.perf_counter() - start, rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def run_dag(graph, pool, max_workers, params=None):
+    """
+    Run a graph of SQL statements, each as soon as its dependencies finish.
+
+    graph maps a statement name to (query, [names it depends on]). Failed
+    statements are reported and everything downstream of them is skipped.
+    Returns {name: {"status", "seconds", "rows"}} for every node.
+    """
+    validate_graph(graph)
+    waiting_on = {name: set(depends_on) for name, (_, depends_on) in graph.items()}
+    results = {}
+
+    def skip_downstream(failed):
+        for name, deps in waiting_on.items():
+            if failed in deps and name not in results:
+                results[name] = {"status": "skipped", "seconds": 0.0, "rows": 0}
+                print(f"Skipping {name}: upstream {failed} did not succeed")
+                skip_downstream(name)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        def submit_ready():
+            for name, deps in waiting_on.items():
+                if not deps and name not in results and name not in running.values():
+                    future = executor.submit(run_statement, pool, graph[name][0], params, name)
+                    running[future] = name
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    seconds, rows = future.result()
+                except Exception as e:
+                    print(f"Error executing {name}: {e}")
+                    results[name] = {"status": "failed", "seconds": 0.0, "rows": 0}
+                    skip_downstream(name)
+                    continue
+                results[name] = {"status": "ok", "seconds": seconds, "rows": rows}
+                print(f"{name} finished in {seconds:.2f}s, {rows} rows")
+                for deps in waiting_on.values():
+                    deps.discard(name)
+            submit_ready()
+
+    return results
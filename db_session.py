@@ -0,0 +1,162 @@
+import configparser
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def load_config(config_file='dwh.cfg'):
+    """Load configuration from a file."""
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    return config
+
+
+def update_config_file(config_file, values):
+    """
+    Set {section: {key: value}} in an INI file, keeping its comments and layout.
+
+    Existing keys are rewritten in place, missing keys are added at the end
+    of their section and missing sections at the end of the file. The file
+    is replaced atomically.
+    """
+    with open(config_file) as f:
+        lines = f.read().splitlines()
+
+    pending = {section: dict(keys) for section, keys in values.items()}
+    output, section = [], None
+
+    def flush(section):
+        if section in pending:
+            output.extend(f"{key}={value}" for key, value in pending.pop(section).items())
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            while output and not output[-1].strip():
+                output.pop()
+            flush(section)
+            if output:
+                output.append("")
+            section = stripped[1:-1].strip()
+        elif section in pending and "=" in stripped and not stripped.startswith(("#", ";")):
+            key = stripped.split("=", 1)[0].strip()
+            match = next((k for k in pending[section] if k.upper() == key.upper()), None)
+            if match is not None:
+                line = f"{key}={pending[section].pop(match)}"
+        output.append(line)
+    flush(section)
+    for name in list(pending):
+        output.extend(["", f"[{name}]"])
+        flush(name)
+
+    with open(config_file + ".tmp", "w") as f:
+        f.write("\n".join(output) + "\n")
+    os.replace(config_file + ".tmp", config_file)
+
+
+def dsn_from_config(config):
+    """
+    Build a libpq connection string from the [CLUSTER] section by key name,
+    with TCP keepalives from [SESSION] so idle pooled connections survive.
+    """
+    cluster = config['CLUSTER']
+    session = config['SESSION'] if config.has_section('SESSION') else {}
+    return (
+        "host={} dbname={} user={} password={} port={} "
+        "keepalives=1 keepalives_idle={} keepalives_interval={} keepalives_count={}"
+    ).format(
+        cluster['HOST'], cluster['DB_NAME'], cluster['DB_USER'], cluster['DB_PASSWORD'], cluster['DB_PORT'],
+        session.get('KEEPALIVES_IDLE', '60'),
+        session.get('KEEPALIVES_INTERVAL', '10'),
+        session.get('KEEPALIVES_COUNT', '5'),
+    )
+
+
+class ConnectionManager:
+    """
+    Thread-safe pool of warehouse connections shared by every pipeline stage.
+
+    POOL_MIN (by default POOL_MAX, the most connections the stages use at
+    once) connections are kept open, as the pool closes any returned beyond
+    it. Each connection gets the configured statement timeout once when first
+    handed out and is returned to the pool rather than closed. getconn/putconn
+    are exposed so the manager can stand in for a pool.
+    """
+
+    def __init__(self, config):
+        session = config['SESSION'] if config.has_section('SESSION') else {}
+        self.statement_timeout = int(session.get('STATEMENT_TIMEOUT_MS', '0'))
+        self.maxconn = int(session.get('POOL_MAX', '8'))
+        self._pool = ThreadedConnectionPool(
+            int(session.get('POOL_MIN', str(self.maxconn))), self.maxconn, dsn_from_config(config)
+        )
+        # Held weakly: a connection the pool closes drops out, so a new one
+        # that happens to reuse its memory is still prepared
+        self._prepared = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        """Take a connection from the pool, applying session settings once."""
+        conn = self._pool.getconn()
+        with self._lock:
+            fresh = conn not in self._prepared
+            self._prepared.add(conn)
+        if fresh and self.statement_timeout:
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout TO %s;", (self.statement_timeout,))
+            conn.commit()
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection to the pool, discarding it if it is broken."""
+        self._pool.putconn(conn, close=bool(conn.closed))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; any open transaction is rolled back on error."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    @contextmanager
+    def session(self):
+        """Borrow a (cursor, connection) pair, as the pipeline scripts use them."""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur, conn
+
+    def closeall(self):
+        """Close every pooled connection."""
+        self._pool.closeall()
+
+
+def get_manager(config=None):
+    """
+    Return the process-wide ConnectionManager for config's cluster, creating
+    it on first use so every stage of a run shares the same connections.
+    """
+    config = config or load_config()
+    key = dsn_from_config(config)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = ConnectionManager(config)
+        return _managers[key]
+
+
+def close_all():
+    """Close every manager created by get_manager."""
+    with _managers_lock:
+        for manager in _managers.values():
+            manager.closeall()
+        _managers.clear()
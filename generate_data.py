@@ -0,0 +1,211 @@
+import os
+import numpy as np
+import pandas as pd
+
+from db_session import load_config
+from sql_queries import staging_column_types
+
+EVENT_COLUMNS = list(staging_column_types["staging_events"])
+SONG_COLUMNS = list(staging_column_types["staging_songs"])
+
+# Share of each page in the event log, roughly as in the sample data
+PAGES = {
+    "NextSong": 0.81, "Home": 0.07, "Thumbs Up": 0.03, "Add to Playlist": 0.02,
+    "Logout": 0.02, "Roll Advert": 0.02, "Thumbs Down": 0.01, "Downgrade": 0.01,
+    "Settings": 0.005, "Help": 0.005,
+}
+
+FIRST_NAMES = np.array(["Theodore", "Ann", "Jahiem", "Kaylee", "Lily", "Jacob", "Tegan", "Chloe",
+                        "Aleena", "Jayden", "Ryan", "Sara", "Matthew", "Ava", "Layla", "Noah"])
+LAST_NAMES = np.array(["Smith", "Banks", "Miles", "Summers", "Koch", "Klein", "Levine", "Cuevas",
+                       "Kirby", "Graves", "Fox", "Johnson", "Jones", "Robinson", "Griffin", "Long"])
+LOCATIONS = np.array(["Houston-The Woodlands-Sugar Land, TX", "Salt Lake City, UT",
+                      "San Antonio-New Braunfels, TX", "Atlanta-Sandy Springs-Roswell, GA",
+                      "San Francisco-Oakland-Hayward, CA", "Chicago-Naperville-Elgin, IL-IN-WI",
+                      "New York-Newark-Jersey City, NY-NJ-PA", "Portland-South Portland, ME",
+                      "Lansing-East Lansing, MI", "Seattle-Tacoma-Bellevue, WA"])
+USER_AGENTS = np.array([
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:31.0) Gecko/20100101 Firefox/31.0",
+    "\"Mozilla/5.0 (Windows NT 5.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36\"",
+    "\"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) Version/7.0.6 Safari/537.78.2\"",
+])
+WORDS = np.array(["Love", "Night", "Blue", "Dream", "Fire", "River", "Heart", "Road", "Light", "Rain",
+                  "Summer", "Ghost", "City", "Gold", "Wild", "Song", "Dance", "Stone", "Star", "Home"])
+
+# 2018-11-01 00:00:00 UTC in epoch milliseconds, the start of the sample log
+DEFAULT_START_TS = 1541030400000
+
+
+def zipf_cdf(n, skew):
+    """Cumulative distribution of a Zipf law over n ranks; skew 0 is uniform."""
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def sample(cdf, size, rng):
+    """Draw ranks from a cumulative distribution with one searchsorted call."""
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), len(cdf) - 1)
+
+
+def random_ids(prefix, n, rng):
+    """Return n 18-character Million-Song-style ids such as SOQPWCR12A6D4FB2A3."""
+    digits = rng.integers(0, 16 ** 8, size=n)
+    serial = np.char.mod("%08X", np.arange(n))
+    return np.char.add(np.char.add(prefix, np.char.mod("%08X", digits)), serial)
+
+
+def write_part(frame, out_dir, name, part):
+    """Write one gzip CSV part with a header row and return its path."""
+    path = os.path.join(out_dir, f"{name}.part{part:05d}.csv.gz")
+    frame.to_csv(path, index=False)
+    return path
+
+
+def build_catalogue(num_songs, num_artists, seed=0):
+    """
+    Build the song catalogue as column arrays in staging_songs order.
+
+    Artists own a Zipf-skewed share of songs; about half the songs have no
+    release year and most artists have no coordinates, as in the real data.
+    """
+    rng = np.random.default_rng(seed)
+    artist_ids = random_ids("AR", num_artists, rng)
+    artist_names = np.char.add(np.char.add(WORDS[rng.integers(0, len(WORDS), num_artists)], " "),
+                               np.char.mod("Band %d", np.arange(num_artists)))
+    has_coords = rng.random(num_artists) < 0.3
+    latitude = np.where(has_coords, rng.uniform(-60, 70, num_artists), np.nan)
+    longitude = np.where(has_coords, rng.uniform(-170, 170, num_artists), np.nan)
+    artist_location = np.where(rng.random(num_artists) < 0.5, LOCATIONS[rng.integers(0, len(LOCATIONS), num_artists)], "")
+
+    artist = sample(zipf_cdf(num_artists, 0.8), num_songs, rng)
+    titles = np.char.add(np.char.add(np.char.add(WORDS[rng.integers(0, len(WORDS), num_songs)], " "),
+                                     WORDS[rng.integers(0, len(WORDS), num_songs)]),
+                         np.char.mod(" %d", np.arange(num_songs)))
+    return {
+        "artist_id": artist_ids[artist],
+        "artist_latitude": latitude[artist],
+        "artist_longitude": longitude[artist],
+        "artist_location": artist_location[artist],
+        "artist_name": artist_names[artist],
+        "song_id": random_ids("SO", num_songs, rng),
+        "num_songs": np.ones(num_songs, dtype="int32"),
+        "title": titles,
+        "duration": np.round(rng.gamma(9.0, 27.0, num_songs), 5),
+        "year": np.where(rng.random(num_songs) < 0.5, 0, rng.integers(1950, 2011, num_songs)),
+    }
+
+
+def generate_songs(catalogue, out_dir, rows_per_part):
+    """Stream the catalogue to songs.partNNNNN.csv.gz files and return their paths."""
+    num_songs = len(catalogue["song_id"])
+    return [
+        write_part(pd.DataFrame({column: catalogue[column][start:start + rows_per_part] for column in SONG_COLUMNS}),
+                   out_dir, "songs", part)
+        for part, start in enumerate(range(0, num_songs, rows_per_part))
+    ]
+
+
+def generate_events(catalogue, num_events, num_users, out_dir, rows_per_part, song_skew=1.1,
+                    user_skew=0.9, mean_session_length=20, days=30, start_ts=DEFAULT_START_TS, seed=1):
+    """
+    Stream num_events synthetic log events to events.partNNNNN.csv.gz files.
+
+    Songs and users are drawn from Zipf distributions (song_skew, user_skew),
+    session lengths are geometric around mean_session_length and timestamps
+    increase steadily over days. Each part is generated and written on its
+    own, so memory depends on rows_per_part rather than num_events.
+    """
+    rng = np.random.default_rng(seed)
+    song_cdf = zipf_cdf(len(catalogue["song_id"]), song_skew)
+    user_cdf = zipf_cdf(num_users, user_skew)
+    page_names = np.array(list(PAGES))
+    page_cdf = np.cumsum(list(PAGES.values()))
+    page_cdf /= page_cdf[-1]
+
+    first_name = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), num_users)]
+    last_name = LAST_NAMES[rng.integers(0, len(LAST_NAMES), num_users)]
+    gender = np.where(rng.random(num_users) < 0.5, "F", "M")
+    user_location = LOCATIONS[rng.integers(0, len(LOCATIONS), num_users)]
+    user_agent = USER_AGENTS[rng.integers(0, len(USER_AGENTS), num_users)]
+    registration = start_ts - rng.integers(0, 90 * 86400000, num_users)
+    paid_from = np.where(rng.random(num_users) < 0.3, rng.random(num_users), np.inf)
+
+    mean_gap_ms = days * 86400000 / max(num_events, 1)
+    clock = float(start_ts)
+    next_session = 1
+    paths = []
+
+    for part, start in enumerate(range(0, num_events, rows_per_part)):
+        size = min(rows_per_part, num_events - start)
+
+        lengths = rng.geometric(1.0 / mean_session_length, size)
+        lengths = lengths[:np.searchsorted(np.cumsum(lengths), size) + 1]
+        session = np.repeat(np.arange(len(lengths)), lengths)[:size]
+        first_in_session = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        item_in_session = np.arange(size) - first_in_session[session]
+        user = sample(user_cdf, len(lengths), rng)[session]
+
+        ts = (clock + np.cumsum(rng.exponential(mean_gap_ms, size))).astype("int64")
+        clock = float(ts[-1])
+        progress = (start + np.arange(size)) / num_events
+
+        page = page_names[sample(page_cdf, size, rng)]
+        next_song = page == "NextSong"
+        song = sample(song_cdf, size, rng)
+
+        events = pd.DataFrame({
+            "artist": np.where(next_song, catalogue["artist_name"][song], ""),
+            "auth": "Logged In",
+            "firstName": first_name[user],
+            "gender": gender[user],
+            "itemInSession": item_in_session,
+            "lastName": last_name[user],
+            "length": np.where(next_song, catalogue["duration"][song], np.nan),
+            "level": np.where(progress >= paid_from[user], "paid", "free"),
+            "location": user_location[user],
+            "method": np.where(next_song, "PUT", "GET"),
+            "page": page,
+            "registration": registration[user].astype("float64"),
+            "sessionId": next_session + session,
+            "song": np.where(next_song, catalogue["title"][song], ""),
+            "status": np.where(rng.random(size) < 0.995, 200, 404),
+            "ts": ts,
+            "userAgent": user_agent[user],
+            "userId": user + 1,
+        }, columns=EVENT_COLUMNS)
+        next_session += len(lengths)
+
+        paths.append(write_part(events, out_dir, "events", part))
+        print(f"Wrote {start + size}/{num_events} events")
+
+    return paths
+
+
+def generate(config):
+    """Generate songs and events at the scale set in the [BENCHMARK] section."""
+    bench = config['BENCHMARK']
+    out_dir = bench.get('DATA_DIR', os.path.join('data', 'synthetic'))
+    rows_per_part = int(bench.get('ROWS_PER_PART', '1000000'))
+    os.makedirs(out_dir, exist_ok=True)
+
+    catalogue = build_catalogue(int(bench.get('SONGS', '10000')), int(bench.get('ARTISTS', '2000')),
+                                seed=int(bench.get('SEED', '0')))
+    song_parts = generate_songs(catalogue, out_dir, rows_per_part)
+    event_parts = generate_events(
+        catalogue, int(bench.get('EVENTS', '100000')), int(bench.get('USERS', '1000')), out_dir, rows_per_part,
+        song_skew=float(bench.get('SONG_SKEW', '1.1')), user_skew=float(bench.get('USER_SKEW', '0.9')),
+        mean_session_length=float(bench.get('SESSION_LENGTH', '20')), days=float(bench.get('DAYS', '30')),
+        seed=int(bench.get('SEED', '0')) + 1
+    )
+    return song_parts, event_parts
+
+
+def main():
+    """Generate synthetic data as configured in benchmark.cfg."""
+    generate(load_config('benchmark.cfg'))
+
+
+if __name__ == "__main__":
+    main()
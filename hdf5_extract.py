@@ -0,0 +1,121 @@
+import os
+import sys
+import h5py
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from parquet_convert import write_parquet
+from sql_queries import staging_column_types
+
+STAGING_SONGS_COLUMNS = list(staging_column_types["staging_songs"])
+
+# Number of .h5 files each worker process handles per output part
+FILES_PER_PART = 500
+
+
+def find_h5_files(root):
+    """Walk a directory tree and return every .h5 file path, sorted."""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths.extend(os.path.join(dirpath, name) for name in filenames if name.endswith(".h5"))
+    return sorted(paths)
+
+
+def decode(values):
+    """Decode a fixed-width bytes array to str in one vectorised call."""
+    return np.char.decode(values, "utf-8", errors="replace") if values.dtype.kind == "S" else values
+
+
+def extract_song_file(path):
+    """
+    Read the staging_songs fields from one Million Song Dataset HDF5 file.
+
+    Whole compound tables are read at once, so every song in the file is
+    handled with column-wise NumPy operations rather than row by row.
+    """
+    with h5py.File(path, "r") as h5:
+        metadata = h5["metadata/songs"][:]
+        duration = h5["analysis/songs"]["duration"]
+        year = h5["musicbrainz/songs"]["year"]
+
+    return pd.DataFrame({
+        "artist_id": decode(metadata["artist_id"]),
+        "artist_latitude": metadata["artist_latitude"].astype("float64"),
+        "artist_longitude": metadata["artist_longitude"].astype("float64"),
+        "artist_location": decode(metadata["artist_location"]),
+        "artist_name": decode(metadata["artist_name"]),
+        "song_id": decode(metadata["song_id"]),
+        "num_songs": len(metadata),
+        "title": decode(metadata["title"]),
+        "duration": duration.astype("float64"),
+        "year": year.astype("int32"),
+    }, columns=STAGING_SONGS_COLUMNS)
+
+
+def extract_part(task):
+    """
+    Extract a batch of files and write them to one part file.
+
+    Runs inside a worker process and writes its own output, so only the
+    row count travels back to the parent. Unreadable files are skipped.
+    """
+    paths, part_path, output_format = task
+    frames = []
+    for path in paths:
+        try:
+            frames.append(extract_song_file(path))
+        except (OSError, KeyError) as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+    if not frames:
+        return 0
+
+    songs = pd.concat(frames, ignore_index=True)
+    if output_format == "parquet":
+        write_parquet(songs, part_path, "staging_songs")
+    else:
+        songs.to_csv(part_path, index=False)
+    return len(songs)
+
+
+def extract_songs(root, out_dir, output_format="csv", files_per_part=FILES_PER_PART, workers=None):
+    """
+    Convert a tree of .h5 song files into staging_songs part files.
+
+    Files are grouped into parts of files_per_part and fanned out over a
+    process pool (one worker per core by default). CSV parts are gzip
+    compressed with a header row, matching what load_staging_tables expects.
+    Returns the number of songs written.
+    """
+    if output_format not in ("csv", "parquet"):
+        raise ValueError(f"Unsupported output format: {output_format}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = find_h5_files(root)
+    suffix = ".csv.gz" if output_format == "csv" else ".parquet"
+    tasks = [
+        (paths[i:i + files_per_part],
+         os.path.join(out_dir, f"songs.part{i // files_per_part:05d}{suffix}"),
+         output_format)
+        for i in range(0, len(paths), files_per_part)
+    ]
+    print(f"Extracting {len(paths)} files into {len(tasks)} parts...")
+
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for rows in executor.map(extract_part, tasks):
+            total += rows
+    print(f"Extracted {total} songs to {out_dir}.")
+    return total
+
+
+def main():
+    """Extract data/Songs into data/songs_parts as gzip CSV parts."""
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "Songs")
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join("data", "songs_parts")
+    output_format = sys.argv[3] if len(sys.argv) > 3 else "csv"
+    extract_songs(root, out_dir, output_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Redshift system views; on other databases these lookups are skipped
+last_query_id_query = "SELECT pg_last_query_id();"
+bytes_scanned_query = """
+    SELECT COALESCE(SUM(bytes), 0)
+    FROM svl_query_summary
+    WHERE query = %s AND is_rrscan = 't';
+"""
+last_copy_count_query = "SELECT pg_last_copy_count();"
+load_errors_query = """
+    SELECT line_number, TRIM(colname), err_code, TRIM(err_reason), TRIM(raw_field_value)
+    FROM stl_load_errors
+    WHERE query = pg_last_copy_id()
+    ORDER BY line_number
+    LIMIT %s;
+"""
+
+_lock = threading.Lock()
+_settings = {"jsonl_path": None, "prometheus_path": None, "redshift_stats": False}
+_run_id = uuid.uuid4().hex
+_records = []
+
+
+def configure(config):
+    """Read output locations and options from the [METRICS] section."""
+    metrics = config['METRICS'] if config.has_section('METRICS') else {}
+    _settings["jsonl_path"] = metrics.get('JSONL_PATH') or None
+    _settings["prometheus_path"] = metrics.get('PROMETHEUS_TEXTFILE') or None
+    _settings["redshift_stats"] = metrics.get('REDSHIFT_STATS', 'true').lower() == 'true'
+
+
+def record(stage, statement, seconds, rows=None, status="ok", **extra):
+    """
+    Record one statement's outcome and append it to the JSON lines file.
+
+    Extra keyword arguments (bytes_scanned, retries, rejected_rows,
+    load_errors, error, ...) are stored as given.
+    """
+    entry = {
+        "run_id": _run_id,
+        "at": datetime.now(timezone.utc).isoformat(),
+        "stage": stage,
+        "statement": statement,
+        "seconds": round(seconds, 4),
+        "rows": rows,
+        "status": status,
+        **extra,
+    }
+    with _lock:
+        _records.append(entry)
+        if _settings["jsonl_path"]:
+            os.makedirs(os.path.dirname(_settings["jsonl_path"]) or ".", exist_ok=True)
+            with open(_settings["jsonl_path"], "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+    return entry
+
+
+def statement_stats(cur, in_transaction=False):
+    """
+    Return bytes scanned by the session's last query, or {} if unavailable.
+
+    In the caller's open transaction a failed lookup is raised, as rolling
+    back would discard the caller's work.
+    """
+    if not _settings["redshift_stats"]:
+        return {}
+    try:
+        cur.execute(last_query_id_query)
+        query_id = cur.fetchone()[0]
+        cur.execute(bytes_scanned_query, (query_id,))
+        return {"query_id": query_id, "bytes_scanned": int(cur.fetchone()[0])}
+    except Exception:
+        if in_transaction:
+            raise
+        cur.connection.rollback()
+        return {}
+
+
+def copy_stats(cur, limit=100, in_transaction=False):
+    """
+    Return rows loaded and rows rejected by the session's last COPY, with
+    up to limit entries from stl_load_errors describing the rejects.
+
+    pg_last_copy_count() and pg_last_copy_id() answer before the COPY is
+    committed, so this also works inside the caller's transaction, where a
+    failed lookup is raised rather than rolled back.
+    """
+    if not _settings["redshift_stats"]:
+        return {}
+    try:
+        cur.execute(last_copy_count_query)
+        loaded = cur.fetchone()[0]
+        cur.execute(load_errors_query, (limit,))
+        errors = [
+            {"line": line, "column": column, "code": code, "reason": reason, "value": value}
+            for line, column, code, reason, value in cur.fetchall()
+        ]
+        return {"rows_loaded": loaded, "rejected_rows": len(errors), "load_errors": errors}
+    except Exception:
+        if in_transaction:
+            raise
+        cur.connection.rollback()
+        return {}
+
+
+def execute_statement(cur, conn, stage, statement, query, params=None, commit=True, copy=False, retries=0):
+    """
+    Execute one statement and record its wall time, row count, bytes
+    scanned and, for COPY, the rows stl_load_errors says were rejected.
+
+    Failures are recorded and re-raised. With commit=False the caller owns
+    the transaction; the stats are looked up inside it.
+    """
+    start = time.perf_counter()
+    try:
+        cur.execute(query, params)
+        rows = cur.rowcount
+        if commit:
+            conn.commit()
+    except Exception as e:
+        record(stage, statement, time.perf_counter() - start, status="failed", retries=retries, error=str(e))
+        if copy:
+            # The failed COPY has aborted the transaction, caller's or not
+            conn.rollback()
+            details = copy_stats(cur)
+            if details.get("load_errors"):
+                print(f"{statement}: {details['load_errors'][:5]}")
+        raise
+    seconds = time.perf_counter() - start
+
+    extra = {"retries": retries}
+    in_transaction = not commit
+    extra.update(copy_stats(cur, in_transaction=in_transaction) if copy
+                 else statement_stats(cur, in_transaction=in_transaction))
+    if extra.get("rejected_rows"):
+        print(f"WARNING: {statement} skipped {extra['rejected_rows']} rejected rows (MAXERROR), "
+              f"first: {extra['load_errors'][0]}")
+    record(stage, statement, seconds, rows, **extra)
+    return rows
+
+
+def summary():
+    """Return a copy of every record made in this process."""
+    with _lock:
+        return list(_records)
+
+
+def write_prometheus(path=None):
+    """
+    Write the latest value per stage/statement as a Prometheus textfile,
+    replacing the file atomically so a collector never sees half of it.
+    """
+    path = path or _settings["prometheus_path"]
+    if not path:
+        return None
+
+    latest = {}
+    for entry in summary():
+        latest[(entry["stage"], entry["statement"])] = entry
+
+    metrics = {
+        "etl_statement_seconds": ("gauge", "Wall time of the statement", "seconds"),
+        "etl_statement_rows": ("gauge", "Rows affected by the statement", "rows"),
+        "etl_statement_bytes_scanned": ("gauge", "Bytes scanned by the statement", "bytes_scanned"),
+        "etl_statement_retries": ("gauge", "Retries before the statement finished", "retries"),
+        "etl_copy_rejected_rows": ("gauge", "Rows COPY skipped under MAXERROR", "rejected_rows"),
+    }
+    lines = []
+    for name, (kind, help_text, field) in metrics.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (stage, statement), entry in latest.items():
+            if entry.get(field) is not None:
+                lines.append(f'{name}{{stage="{stage}",statement="{statement}"}} {entry[field]}')
+    lines.append("# HELP etl_statement_failed 1 if the last run of the statement failed")
+    lines.append("# TYPE etl_statement_failed gauge")
+    for (stage, statement), entry in latest.items():
+        lines.append(f'etl_statement_failed{{stage="{stage}",statement="{statement}"}} '
+                     f'{int(entry["status"] != "ok")}')
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+    return path
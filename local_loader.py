@@ -0,0 +1,210 @@
+import io
+import math
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from db_session import close_all, get_manager, load_config
+from sql_queries import staging_column_types, time_load_table_create, time_table_insert_from_load
+
+# Number of CSV rows held in memory at once
+CHUNK_SIZE = 100000
+
+INTEGER_PATTERN = re.compile(r"[+-]?\d+")
+
+INTEGER_RANGES = {
+    "bigint": (-9223372036854775808, 9223372036854775807),
+    "int": (-2147483648, 2147483647),
+}
+
+
+def parse_integers(raw, low, high):
+    """
+    Parse a column of raw strings into exact nullable integers.
+
+    Plain digit strings are converted with int(), so values beyond 2**53
+    keep every digit; other numeric strings (e.g. "12.0") are accepted
+    when integral. Values outside [low, high] become NULL. Returns
+    (Int64 values, mask of unparseable entries).
+    """
+    values, invalid = [], []
+    for text in raw:
+        value, bad = None, False
+        if isinstance(text, str):
+            text = text.strip()
+            if INTEGER_PATTERN.fullmatch(text):
+                value = int(text)
+            else:
+                try:
+                    number = float(text)
+                except ValueError:
+                    number = math.nan
+                if math.isnan(number):
+                    bad = True
+                elif low <= number <= high:
+                    if number % 1:
+                        bad = True
+                    else:
+                        value = int(number)
+        if value is not None and not low <= value <= high:
+            value = None
+        values.append(value)
+        invalid.append(bad)
+    return (pd.Series(pd.array(values, dtype="Int64"), index=raw.index),
+            pd.Series(invalid, index=raw.index, dtype=bool))
+
+
+def sanitise_chunk(chunk, column_types):
+    """
+    Validate a chunk of raw CSV strings against the staging column types.
+
+    Integers outside the column's range are replaced with NULL, as the old
+    row-by-row loader did. Rows holding values that do not parse as numbers
+    are returned separately as rejects, with the offending columns listed.
+    """
+    clean = chunk.copy()
+    reasons = pd.Series("", index=chunk.index)
+
+    for column, sql_type in column_types.items():
+        if sql_type == "text" or column not in chunk:
+            continue
+        raw = chunk[column]
+
+        if sql_type in INTEGER_RANGES:
+            clean[column], invalid = parse_integers(raw, *INTEGER_RANGES[sql_type])
+        else:
+            values = pd.to_numeric(raw, errors="coerce")
+            invalid = raw.notna() & values.isna()
+            clean[column] = values.mask(invalid)
+
+        reasons = reasons.mask(invalid, reasons + column + ";")
+
+    rejected = reasons != ""
+    rejects = chunk[rejected].assign(reject_reason=reasons[rejected].str.rstrip(";"))
+    return clean[~rejected], rejects
+
+
+def copy_chunk(cur, table_name, chunk):
+    """Stream one DataFrame chunk into a table with COPY ... FROM STDIN."""
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, header=False, index=False, na_rep="")
+    buffer.seek(0)
+    columns = ", ".join(chunk.columns)
+    cur.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load_csv_to_staging(table_name, csv_file, cur, conn, chunk_size=CHUNK_SIZE, reject_file=None):
+    """
+    Load a local CSV file into a staging table in fixed-size chunks.
+
+    Each chunk is sanitised and streamed through COPY FROM STDIN, and the
+    whole file is committed as one transaction. Rejected rows are written
+    to reject_file (default: <csv_file>.rejects.csv).
+    """
+    column_types = staging_column_types[table_name]
+    if reject_file is None:
+        reject_file = f"{os.path.splitext(csv_file)[0]}.rejects.csv"
+
+    loaded = rejected = 0
+    reject_header = True
+    try:
+        reader = pd.read_csv(csv_file, dtype=str, chunksize=chunk_size,
+                             keep_default_na=False, na_values=[""])
+        for chunk in reader:
+            unknown = set(chunk.columns) - set(column_types)
+            if unknown:
+                raise ValueError(f"Columns not in {table_name}: {sorted(unknown)}")
+
+            clean, rejects = sanitise_chunk(chunk, column_types)
+            copy_chunk(cur, table_name, clean)
+            loaded += len(clean)
+
+            if len(rejects):
+                rejects.to_csv(reject_file, mode="w" if reject_header else "a",
+                               header=reject_header, index=False)
+                reject_header = False
+                rejected += len(rejects)
+
+        conn.commit()
+        print(f"Loaded {loaded} rows into {table_name} from {csv_file}.")
+        if rejected:
+            print(f"Rejected {rejected} rows, see {reject_file}.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error loading {csv_file} into {table_name}: {e}")
+        raise
+    return loaded, rejected
+
+
+def time_dimension_frame(ts):
+    """
+    Build time dimension rows for a set of epoch-millisecond timestamps.
+
+    Timestamps are de-duplicated first and every field is derived from one
+    datetime64 conversion. week is the ISO week and weekday is 0 = Sunday,
+    matching EXTRACT(WEEK) and EXTRACT(DOW) in time_table_insert.
+    """
+    ts = np.unique(np.asarray(ts, dtype="int64"))
+    start = pd.DatetimeIndex(ts.astype("datetime64[ms]"))
+    return pd.DataFrame({
+        "starttime": ts,
+        "hour": start.hour,
+        "day": start.day,
+        "week": start.isocalendar().week.to_numpy(dtype="int64"),
+        "month": start.month,
+        "year": start.year,
+        "weekday": ((start.dayofweek + 1) % 7).astype(str),
+    })
+
+
+def load_time_dimension(csv_file, cur, conn, chunk_size=CHUNK_SIZE):
+    """
+    Populate the time dimension from a local events CSV.
+
+    Only the page and ts columns are read. Distinct NextSong timestamps are
+    built client-side, streamed into a temporary table and inserted with a
+    single anti-join, so timestamps already in time are skipped.
+    """
+    distinct_ts = np.empty(0, dtype="int64")
+    for chunk in pd.read_csv(csv_file, usecols=["page", "ts"], chunksize=chunk_size):
+        ts = chunk.loc[chunk["page"] == "NextSong", "ts"].dropna().astype("int64")
+        distinct_ts = np.union1d(distinct_ts, ts.to_numpy())
+
+    try:
+        cur.execute(time_load_table_create)
+        frame = time_dimension_frame(distinct_ts)
+        for start in range(0, len(frame), chunk_size):
+            copy_chunk(cur, "time_load", frame.iloc[start:start + chunk_size])
+        cur.execute(time_table_insert_from_load)
+        inserted = cur.rowcount
+        cur.execute("DROP TABLE time_load;")
+        conn.commit()
+        print(f"Inserted {inserted} of {len(frame)} distinct timestamps into time.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error loading time dimension from {csv_file}: {e}")
+        raise
+    return inserted
+
+
+def main():
+    """
+    Load data/events.csv and data/songs.csv straight into the staging
+    tables, for use when S3 is unavailable, and build the time dimension
+    from the events client-side.
+    """
+    config = load_config('dwh.cfg')
+    events_csv = os.path.join("data", "events.csv")
+
+    with get_manager(config).session() as (cur, conn):
+        load_csv_to_staging("staging_events", events_csv, cur, conn)
+        load_csv_to_staging("staging_songs", os.path.join("data", "songs.csv"), cur, conn)
+        load_time_dimension(events_csv, cur, conn)
+
+    close_all()
+    print("Database connection closed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_session import close_all, get_manager, load_config
+from instrumentation import configure, execute_statement, write_prometheus
+from sql_queries import clear_staging_tables, create_table_queries
+from table_layout import parse_create_query
+
+# Every table the pipeline creates except the staging tables, which are
+# emptied on every load and loaded with STATUPDATE OFF on purpose
+MAINTAINED_TABLES = [
+    table for table in (parse_create_query(query)[0] for query in create_table_queries)
+    if table not in clear_staging_tables
+]
+
+# Redshift table health: unsorted and stats_off are percentages, and
+# tbl_rows still counts rows that are deleted but not yet vacuumed away.
+table_health_query = """
+    SELECT "table", COALESCE(unsorted, 0), COALESCE(stats_off, 0),
+           COALESCE(tbl_rows, 0), COALESCE(estimated_visible_rows, tbl_rows, 0)
+    FROM svv_table_info
+    WHERE schema = current_schema() AND "table" IN %s;
+"""
+
+MAINTENANCE_COMMANDS = {
+    "sort": "VACUUM SORT ONLY {table};",
+    "delete": "VACUUM DELETE ONLY {table};",
+    "full": "VACUUM FULL {table};",
+    "analyze": "ANALYZE {table};",
+}
+
+
+def table_health(cur, tables=MAINTAINED_TABLES):
+    """
+    Return {table: {"unsorted", "stats_off", "deleted"}} as percentages for
+    tables, or {} if svv_table_info is unavailable (e.g. not Redshift).
+    Empty tables are left out.
+    """
+    try:
+        cur.execute(table_health_query, (tuple(tables),))
+        rows = cur.fetchall()
+    except Exception as e:
+        print(f"Could not read table health, skipping maintenance: {e}")
+        return {}
+    finally:
+        cur.connection.rollback()
+    return {
+        table: {
+            "unsorted": float(unsorted),
+            "stats_off": float(stats_off),
+            "deleted": 100.0 * (float(total) - float(visible)) / float(total),
+        }
+        for table, unsorted, stats_off, total, visible in rows if total
+    }
+
+
+def plan_maintenance(health, unsorted_pct, stats_off_pct, deleted_pct):
+    """
+    Return the (table, action, reason) tasks whose thresholds are crossed.
+
+    A table over both the unsorted and deleted thresholds gets a full
+    VACUUM, over one of them a SORT ONLY or DELETE ONLY vacuum. Stale
+    statistics get an ANALYZE. Vacuums come first, the worst table first.
+    """
+    vacuums, analyzes = [], []
+    for table, stats in health.items():
+        sort = stats["unsorted"] >= unsorted_pct
+        delete = stats["deleted"] >= deleted_pct
+        if sort or delete:
+            action = "full" if sort and delete else "sort" if sort else "delete"
+            vacuums.append((max(stats["unsorted"], stats["deleted"]), table, action,
+                            f"{stats['unsorted']:.1f}% unsorted, {stats['deleted']:.1f}% deleted"))
+        if stats["stats_off"] >= stats_off_pct:
+            analyzes.append((stats["stats_off"], table, "analyze", f"stats {stats['stats_off']:.1f}% off"))
+    return [task[1:] for task in sorted(vacuums, reverse=True) + sorted(analyzes, reverse=True)]
+
+
+def run_tasks(manager, tasks, deadline):
+    """
+    Run tasks one after another on an autocommit connection (VACUUM cannot
+    run in a transaction), where execute_statement's commit does nothing
+    and its stats lookups cannot fail a finished task. Tasks not started by
+    deadline are deferred.
+    Returns one result dict per task.
+    """
+    results = []
+    with manager.connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for table, action, reason in tasks:
+                    result = {"table": table, "action": action, "reason": reason}
+                    results.append(result)
+                    if time.monotonic() >= deadline:
+                        result["status"] = "deferred"
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        execute_statement(cur, conn, "maintenance", f"{action}_{table}",
+                                          MAINTENANCE_COMMANDS[action].format(table=table))
+                        result["status"] = "ok"
+                    except Exception as e:
+                        print(f"Error running {action} on {table}: {e}")
+                        result.update(status="failed", error=str(e))
+                    result["seconds"] = round(time.perf_counter() - start, 2)
+                    print(f"{action} {table} ({reason}): {result['status']} in {result['seconds']:.2f}s")
+        finally:
+            conn.autocommit = False
+    return results
+
+
+def run_maintenance(config, manager=None):
+    """
+    VACUUM and ANALYZE the tables whose health crosses the [MAINTENANCE]
+    thresholds, within TIME_BUDGET_SECONDS.
+
+    Redshift runs one VACUUM at a time per cluster, so vacuums run in
+    sequence, each followed by its table's ANALYZE; the remaining ANALYZEs
+    run concurrently alongside them. Nothing new starts once the budget is
+    spent. Returns the task results.
+    """
+    maintenance = config['MAINTENANCE'] if config.has_section('MAINTENANCE') else {}
+    manager = manager or get_manager(config)
+    with manager.session() as (cur, conn):
+        health = table_health(cur)
+    tasks = plan_maintenance(
+        health,
+        float(maintenance.get('UNSORTED_PCT', '10')),
+        float(maintenance.get('STATS_OFF_PCT', '10')),
+        float(maintenance.get('DELETED_PCT', '10')),
+    )
+    if not tasks:
+        print(f"No maintenance needed on {len(health)} tables.")
+        return []
+
+    vacuumed = {table for table, action, _ in tasks if action != "analyze"}
+    chain = []
+    for task in tasks:
+        if task[1] != "analyze":
+            chain.append(task)
+            chain.extend(other for other in tasks if other[0] == task[0] and other[1] == "analyze")
+    jobs = ([chain] if chain else []) + [[task] for task in tasks if task[0] not in vacuumed]
+
+    deadline = time.monotonic() + float(maintenance.get('TIME_BUDGET_SECONDS', '1800'))
+    max_workers = max(1, min(int(maintenance.get('MAX_WORKERS', '4')), manager.maxconn - 1, len(jobs)))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = [result for job in pool.map(lambda job: run_tasks(manager, job, deadline), jobs)
+                   for result in job]
+
+    deferred = [f"{result['action']} {result['table']}" for result in results if result["status"] == "deferred"]
+    if deferred:
+        print(f"Time budget spent, deferred: {', '.join(deferred)}")
+    return results
+
+
+def main():
+    """Run table maintenance against the cluster in dwh.cfg."""
+    config = load_config('dwh.cfg')
+    configure(config)
+    run_maintenance(config)
+    close_all()
+    write_prometheus()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import math
+import os
+import sys
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from local_loader import sanitise_chunk
+from sql_queries import staging_column_types
+
+# Redshift NUMERIC without precision is NUMERIC(18,0); COPY ... FORMAT AS
+# PARQUET needs a matching DECIMAL, so numeric columns are rounded to it.
+ARROW_TYPES = {
+    "text": pa.string(),
+    "bigint": pa.int64(),
+    "int": pa.int32(),
+    "float": pa.float64(),
+    "numeric": pa.decimal128(18, 0),
+}
+
+# Upper bound on rows per row group; Redshift reads row groups in parallel
+ROW_GROUP_ROWS = 1000000
+COMPRESSION = "snappy"
+
+
+def arrow_schema(table_name):
+    """Return the Parquet schema for a staging table, in DDL column order."""
+    return pa.schema([(column, ARROW_TYPES[sql_type])
+                      for column, sql_type in staging_column_types[table_name].items()])
+
+
+def to_arrow(frame, table_name):
+    """Convert a sanitised DataFrame chunk into an Arrow table with the staging schema."""
+    schema = arrow_schema(table_name)
+    arrays = []
+    for field in schema:
+        values = frame[field.name]
+        if pa.types.is_decimal(field.type):
+            arrays.append(pa.array(values.astype("float64").round(0), from_pandas=True).cast(field.type))
+        elif pa.types.is_string(field.type):
+            arrays.append(pa.array(values.astype(object), type=field.type, from_pandas=True))
+        else:
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(frame, path, table_name, row_group_size=ROW_GROUP_ROWS):
+    """Write one DataFrame as a typed, compressed Parquet file."""
+    pq.write_table(to_arrow(frame, table_name), path, row_group_size=row_group_size, compression=COMPRESSION)
+    return path
+
+
+def count_rows(csv_file):
+    """Count data rows (excluding the header) by scanning raw bytes."""
+    with open(csv_file, "rb") as f:
+        return sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1
+
+
+def csv_to_parquet(table_name, csv_file, out_dir, num_files=1):
+    """
+    Convert a CSV into num_files Parquet files of roughly equal row counts.
+
+    The CSV is streamed one row group at a time (at most ROW_GROUP_ROWS
+    rows), typed with the same sanitisation as the local loader (rejected
+    rows go to a side file) and written as that row group. With one file per
+    cluster slice (num_files) COPY loads every slice in parallel. Returns
+    the file paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(csv_file))[0]
+    rows_per_file = max(1, math.ceil(count_rows(csv_file) / num_files))
+    row_group_size = min(rows_per_file, ROW_GROUP_ROWS)
+    reject_file = os.path.join(out_dir, f"{name}.rejects.csv")
+    schema = arrow_schema(table_name)
+
+    paths, writer, written, rejected = [], None, 0, 0
+    try:
+        reader = pd.read_csv(csv_file, dtype=str, chunksize=row_group_size, keep_default_na=False, na_values=[""])
+        for chunk in reader:
+            clean, rejects = sanitise_chunk(chunk, staging_column_types[table_name])
+            if len(rejects):
+                rejects.to_csv(reject_file, mode="a" if rejected else "w", header=not rejected, index=False)
+                rejected += len(rejects)
+
+            while len(clean):
+                if writer is None or written >= rows_per_file:
+                    if writer is not None:
+                        writer.close()
+                    paths.append(os.path.join(out_dir, f"{name}.part{len(paths):04d}.parquet"))
+                    writer = pq.ParquetWriter(paths[-1], schema, compression=COMPRESSION)
+                    written = 0
+                take = clean.iloc[:rows_per_file - written]
+                writer.write_table(to_arrow(take, table_name), row_group_size=row_group_size)
+                written += len(take)
+                clean = clean.iloc[len(take):]
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f"Converted {csv_file} into {len(paths)} Parquet files" +
+          (f", {rejected} rows rejected (see {reject_file})." if rejected else "."))
+    return paths
+
+
+def main():
+    """Convert data/events.csv and data/songs.csv into data/parquet."""
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "parquet")
+    csv_to_parquet("staging_events", os.path.join("data", "events.csv"), out_dir)
+    csv_to_parquet("staging_songs", os.path.join("data", "songs.csv"), out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone
+import pandas as pd
+
+from local_loader import CHUNK_SIZE
+
+PARTITION_FILE = "events.csv.gz"
+
+
+def partition_names(ts):
+    """Return the year=/month=/day= partition of each epoch-millisecond ts (UTC)."""
+    return pd.to_datetime(ts, unit="ms", utc=True).dt.strftime("year=%Y/month=%m/day=%d")
+
+
+def partition_events(csv_file, out_dir, chunk_size=CHUNK_SIZE):
+    """
+    Split an event log into one gzip CSV per day under out_dir.
+
+    Rows are routed by ts into <out_dir>/year=YYYY/month=MM/day=DD/events.csv.gz,
+    each file with its own header row. The gzip header carries no timestamp,
+    so an unchanged day produces byte-identical output and the same hash.
+    Rows whose ts is missing or not a number are skipped. Returns
+    {partition: {"path", "rows"}}.
+    """
+    handles, partitions, skipped = {}, {}, 0
+    try:
+        reader = pd.read_csv(csv_file, dtype=str, chunksize=chunk_size, keep_default_na=False, na_values=[""])
+        for chunk in reader:
+            ts = pd.to_numeric(chunk["ts"], errors="coerce")
+            skipped += int(ts.isna().sum())
+            chunk = chunk[ts.notna()]
+            for name, rows in chunk.groupby(partition_names(ts[ts.notna()]), sort=False):
+                if name not in handles:
+                    path = os.path.join(out_dir, name, PARTITION_FILE)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    handles[name] = io.TextIOWrapper(gzip.GzipFile(path, "wb", mtime=0), newline="")
+                    partitions[name] = {"path": path, "rows": 0}
+                    rows.iloc[:0].to_csv(handles[name], index=False)
+                rows.to_csv(handles[name], header=False, index=False)
+                partitions[name]["rows"] += len(rows)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    print(f"Split {csv_file} into {len(partitions)} daily partitions" +
+          (f", skipped {skipped} rows without a valid ts." if skipped else "."))
+    return partitions
+
+
+def file_hash(path):
+    """Return the MD5 hex digest of a file."""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_catalogue(path):
+    """Read the partition catalogue, or return an empty one if it does not exist."""
+    if not os.path.exists(path):
+        return {"partitions": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(data, path):
+    """Write data as JSON atomically, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def save_catalogue(catalogue, path):
+    """Write the partition catalogue atomically."""
+    save_json(catalogue, path)
+
+
+def update_catalogue(catalogue, partitions, prefix):
+    """
+    Record the current content of each partition in the catalogue.
+
+    An entry keeps the hash it had when it was last uploaded and last loaded,
+    so a partition is pending for a state until those hashes match again.
+    """
+    for name, info in partitions.items():
+        entry = catalogue["partitions"].setdefault(name, {})
+        entry.update({
+            "path": info["path"],
+            "key": f"{prefix}/{name}/{PARTITION_FILE}",
+            "rows": info["rows"],
+            "bytes": os.path.getsize(info["path"]),
+            "hash": file_hash(info["path"]),
+        })
+    return catalogue
+
+
+def pending_partitions(catalogue, state):
+    """Return the sorted partitions whose content changed since they were last uploaded/loaded."""
+    return sorted(
+        name for name, entry in catalogue["partitions"].items()
+        if entry.get(f"{state}_hash") != entry["hash"]
+    )
+
+
+def mark_partitions(catalogue, names, state):
+    """Record that the current content of names has been uploaded/loaded."""
+    now = datetime.now(timezone.utc).isoformat()
+    for name in names:
+        entry = catalogue["partitions"][name]
+        entry[f"{state}_hash"] = entry["hash"]
+        entry[f"{state}_at"] = now
+    return catalogue
+
+
+def reset_partitions(catalogue, state):
+    """Forget that any partition was uploaded/loaded, making every partition pending for state."""
+    for entry in catalogue["partitions"].values():
+        entry.pop(f"{state}_hash", None)
+        entry.pop(f"{state}_at", None)
+    return catalogue
+
+
+def main():
+    """Split data/events.csv into data/partitions/events and print what is pending."""
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "partitions", "events")
+    catalogue_path = os.path.join(os.path.dirname(out_dir), "catalogue.json")
+    catalogue = update_catalogue(load_catalogue(catalogue_path),
+                                 partition_events(os.path.join("data", "events.csv"), out_dir), "events_data")
+    save_catalogue(catalogue, catalogue_path)
+    print(f"{len(pending_partitions(catalogue, 'loaded'))} of {len(catalogue['partitions'])} partitions pending load.")
+
+
+if __name__ == "__main__":
+    main()
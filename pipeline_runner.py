@@ -0,0 +1,257 @@
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+import psycopg2
+
+from ETL import mark_partitions_loaded, staging_copy_queries
+from db_session import close_all, get_manager, load_config
+from instrumentation import configure, execute_statement, write_prometheus
+from maintenance import run_maintenance
+from query_service import notify_load_finished
+from sql_queries import (
+    clear_staging_events,
+    clear_staging_songs,
+    incremental_insert_tables,
+    insert_table_graph,
+    load_watermark_update,
+)
+
+# SQLSTATEs worth retrying: serialization failure, deadlock, too many connections
+TRANSIENT_PGCODES = {"40001", "40P01", "53300"}
+
+state_tables_create = ("""
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        finished_at TEXT,
+        status TEXT NOT NULL,
+        partitions TEXT
+    );
+    CREATE TABLE IF NOT EXISTS stages (
+        run_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        seconds REAL,
+        rows INTEGER,
+        error TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (run_id, stage)
+    );
+""")
+
+
+def now():
+    """Return the current UTC time as an ISO 8601 string."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StateStore:
+    """
+    Local SQLite record of pipeline runs and the stages each one completed.
+
+    A run stays open until every stage has succeeded, so the next invocation
+    picks it up again and skips the stages already marked done. A run also
+    records the event partitions it staged, so a resumed run marks exactly
+    those as loaded.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(state_tables_create)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(runs)")}
+        if "partitions" not in columns:
+            with self._db:
+                self._db.execute("ALTER TABLE runs ADD COLUMN partitions TEXT")
+
+    def start_run(self, restart=False):
+        """Return (run_id, resumed): the latest unfinished run, or a new one."""
+        row = self._db.execute(
+            "SELECT run_id FROM runs WHERE status != 'done' ORDER BY started_at DESC LIMIT 1"
+        ).fetchone()
+        with self._db:
+            if row and restart:
+                self._db.execute("UPDATE runs SET status = 'abandoned' WHERE run_id = ?", row)
+            elif row:
+                self._db.execute("UPDATE runs SET status = 'running' WHERE run_id = ?", row)
+                return row[0], True
+            run_id = uuid.uuid4().hex
+            self._db.execute("INSERT INTO runs VALUES (?, ?, NULL, 'running', NULL)", (run_id, now()))
+        return run_id, False
+
+    def completed(self, run_id):
+        """Return the names of the stages run_id has finished."""
+        rows = self._db.execute("SELECT stage FROM stages WHERE run_id = ? AND status = 'done'", (run_id,))
+        return {stage for stage, in rows}
+
+    def mark_stage(self, run_id, stage, status, attempts, seconds=None, rows=None, error=None, partitions=None):
+        """Record the outcome of a stage attempt, and the partitions it staged if given."""
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, stage, status, attempts, seconds, rows, error, now())
+            )
+            if partitions is not None:
+                self._db.execute("UPDATE runs SET partitions = ? WHERE run_id = ?",
+                                 (json.dumps(partitions), run_id))
+
+    def staged_partitions(self, run_id):
+        """Return the event partitions run_id staged, or [] if it recorded none."""
+        row = self._db.execute("SELECT partitions FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else []
+
+    def finish_run(self, run_id, status):
+        """Mark a run done, or failed so the next invocation resumes it."""
+        with self._db:
+            self._db.execute("UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?",
+                             (status, now(), run_id))
+
+    def close(self):
+        """Close the SQLite connection."""
+        self._db.close()
+
+
+def is_transient(error):
+    """
+    Return True for errors a retry can fix: lost connections, serialization
+    failures, deadlocks and too many connections.
+
+    A lost connection surfaces as an InterfaceError, or as an
+    OperationalError with no SQLSTATE because the server never answered.
+    OperationalErrors the server reports, such as a statement_timeout
+    cancel (57014) or a full disk (53100), would fail the same way again.
+    """
+    if isinstance(error, psycopg2.InterfaceError):
+        return True
+    pgcode = getattr(error, "pgcode", None)
+    if isinstance(error, psycopg2.OperationalError) and pgcode is None:
+        return True
+    return pgcode in TRANSIENT_PGCODES
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def pipeline_stages(config):
+    """
+    Return the pipeline as an ordered list of (stage, statements), and the
+    event partitions it stages.
+
+    Each stage's statements run in one transaction, so a stage either
+    completes or leaves no trace. Staging tables are emptied in the same
+    transaction as their COPY, which makes repeating a stage safe.
+    statements are (name, query, params, is_copy) tuples.
+    """
+    copies, partitions = staging_copy_queries(config)
+    stages = [
+        ("staging_events", [("clear_staging_events", clear_staging_events, None, False)] +
+         ([("staging_events", copies["staging_events"], None, True)] if "staging_events" in copies else [])),
+        ("staging_songs", [("clear_staging_songs", clear_staging_songs, None, False),
+                           ("staging_songs", copies["staging_songs"], None, True)]),
+    ]
+
+    if config.getboolean('ETL', 'INCREMENTAL', fallback=False):
+        params = {"source": config.get('S3', 'EVENT_SOURCE', fallback='') or config['S3']['EVENT_CSV']}
+        stages.append(("insert_incremental", [
+            (name, query, params, False) for name, query in incremental_insert_tables.items()
+        ] + [("load_watermark", load_watermark_update, params, False)]))
+    else:
+        stages.extend((name, [(name, query, None, False)]) for name, (query, _) in insert_table_graph.items())
+    return stages, partitions
+
+
+def run_stage(manager, statements, attempt):
+    """Run one stage's statements in a single transaction and return the rows affected."""
+    rows = 0
+    with manager.session() as (cur, conn):
+        for name, query, params, is_copy in statements:
+            rows += max(execute_statement(cur, conn, "runner", name, query, params,
+                                          commit=False, copy=is_copy, retries=attempt), 0)
+        conn.commit()
+    return rows
+
+
+def run_pipeline(config, restart=False):
+    """
+    Run every stage of the pipeline, resuming the last unfinished run.
+
+    Stages already completed by that run are skipped. Transient failures are
+    retried up to MAX_ATTEMPTS times with jittered exponential backoff; any
+    other failure, or running out of attempts, stops the run so the next
+    invocation resumes from the failed stage. Returns True if every stage
+    has completed.
+    """
+    runner = config['RUNNER'] if config.has_section('RUNNER') else {}
+    max_attempts = int(runner.get('MAX_ATTEMPTS', '4'))
+    base = float(runner.get('BACKOFF_BASE_SECONDS', '2'))
+    cap = float(runner.get('BACKOFF_MAX_SECONDS', '60'))
+
+    store = StateStore(runner.get('STATE_PATH', os.path.join('metrics', 'pipeline_state.sqlite')))
+    run_id, resumed = store.start_run(restart)
+    done = store.completed(run_id)
+    print(f"Resuming run {run_id}, {len(done)} stages already done." if resumed else f"Starting run {run_id}.")
+
+    manager = get_manager(config)
+    try:
+        stages, partitions = pipeline_stages(config)
+        # Days uploaded since this run staged its events were never staged by it
+        if "staging_events" in done:
+            partitions = store.staged_partitions(run_id)
+        for stage, statements in stages:
+            if stage in done:
+                print(f"Skipping {stage}: completed earlier in this run")
+                continue
+            for attempt in range(max_attempts):
+                start = time.perf_counter()
+                try:
+                    rows = run_stage(manager, statements, attempt)
+                except Exception as e:
+                    retry = is_transient(e) and attempt + 1 < max_attempts
+                    store.mark_stage(run_id, stage, "failed", attempt + 1, time.perf_counter() - start, error=str(e))
+                    if not retry:
+                        print(f"Error in {stage} after {attempt + 1} attempts, stopping: {e}")
+                        store.finish_run(run_id, "failed")
+                        return False
+                    delay = backoff_delay(attempt, base, cap)
+                    print(f"Transient error in {stage}, retrying in {delay:.1f}s: {e}")
+                    time.sleep(delay)
+                    continue
+                seconds = time.perf_counter() - start
+                store.mark_stage(run_id, stage, "done", attempt + 1, seconds, rows,
+                                 partitions=partitions if stage == "staging_events" else None)
+                print(f"{stage} finished in {seconds:.2f}s, {rows} rows")
+                break
+
+        mark_partitions_loaded(config, partitions)
+        store.finish_run(run_id, "done")
+        print(f"Run {run_id} complete.")
+        if config.getboolean('MAINTENANCE', 'AFTER_LOAD', fallback=False):
+            run_maintenance(config, manager)
+        return True
+    finally:
+        store.close()
+        # Even a stopped run may have committed some stages
+        notify_load_finished(config)
+
+
+def main():
+    """Run or resume the pipeline configured in dwh.cfg; --restart abandons an unfinished run."""
+    config = load_config('dwh.cfg')
+    configure(config)
+    succeeded = run_pipeline(config, restart="--restart" in sys.argv[1:])
+    close_all()
+    write_prometheus()
+    if not succeeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import json
+import os
+import re
+import sys
+
+from db_session import close_all, get_manager, load_config
+from query_service import CANNED_QUERIES
+from sql_queries import incremental_insert_tables, insert_table_graph, stream_insert_tables
+
+# Redshift join distributions that move data between nodes at run time:
+# broadcasting the inner table, redistributing both sides, or copying the
+# whole inner table to every node. DS_DIST_NONE/DS_DIST_ALL_NONE are free.
+COSTLY_DISTRIBUTIONS = {"DS_BCAST_INNER", "DS_DIST_BOTH", "DS_DIST_ALL_INNER"}
+COSTLY_OPERATORS = {"Nested Loop"}
+
+# Values for the placeholders of parameterised statements; only the plan matters
+SAMPLE_PARAMS = {"source": "plan_analyser", "user_id": 0}
+
+# One plan node: "->  XN Hash Join DS_BCAST_INNER  (cost=0.05..1234.56 rows=10 width=50)"
+node_pattern = re.compile(
+    r"^(?P<indent>\s*)(?:->\s+)?(?P<label>.+?)\s+"
+    r"\(cost=(?P<startup>[\d.]+)\.\.(?P<total>[\d.]+) rows=(?P<rows>\d+) width=(?P<width>\d+)\)"
+)
+missing_stats_pattern = re.compile(r"Tables missing statistics:\s*(?P<tables>.+?)\s*-*$")
+ctas_pattern = re.compile(r"^(CREATE\s+TEMP(?:ORARY)?\s+TABLE\s+\S+\s+AS)\s+(.*)$", re.IGNORECASE | re.DOTALL)
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def split_statements(sql):
+    """Split a ;-separated script into its statements, ignoring ; inside quoted literals."""
+    statements, current = [], ""
+    for i, part in enumerate(re.split(r"('(?:[^']|'')*')", sql)):
+        if i % 2:
+            current += part
+            continue
+        pieces = part.split(";")
+        current += pieces[0]
+        for piece in pieces[1:]:
+            statements.append(current.strip())
+            current = piece
+    statements.append(current.strip())
+    return [statement for statement in statements if statement]
+
+
+def parse_plan(lines):
+    """
+    Parse EXPLAIN output into a tree of nodes.
+
+    Each node is a dict with operator, distribution (the DS_* join
+    strategy, if any), relation, startup/total cost, rows, width, details
+    (condition and filter lines) and children. Returns (root, tables
+    missing statistics).
+    """
+    root, stack, missing = None, [], []
+    for line in lines:
+        stats = missing_stats_pattern.search(line)
+        if stats:
+            missing.extend(table.strip() for table in stats.group("tables").split(","))
+            continue
+        match = node_pattern.match(line)
+        if not match:
+            if stack and line.strip() and not line.lstrip().startswith("-----"):
+                stack[-1][1]["details"].append(line.strip())
+            continue
+
+        label = re.sub(r"^XN\s+", "", match.group("label"))
+        distribution = re.search(r"\b(DS_\w+)", label)
+        relation = re.search(r"\bon\s+(\S+)", label)
+        operator = re.sub(r"\s+(DS_\w+|on\s+.*)$", "", label).strip()
+        node = {
+            "operator": operator,
+            "distribution": distribution.group(1) if distribution else None,
+            "relation": relation.group(1) if relation else None,
+            "startup_cost": float(match.group("startup")),
+            "total_cost": float(match.group("total")),
+            "rows": int(match.group("rows")),
+            "width": int(match.group("width")),
+            "details": [],
+            "children": [],
+        }
+        indent = len(match.group("indent"))
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        if stack:
+            stack[-1][1]["children"].append(node)
+        elif root is None:
+            root = node
+        stack.append((indent, node))
+    return root, missing
+
+
+def walk(node):
+    """Yield node and all of its descendants, depth first."""
+    yield node
+    for child in node["children"]:
+        yield from walk(child)
+
+
+def plan_flags(root, missing):
+    """Return sorted, human-readable flags for the costly parts of a plan."""
+    flags = set()
+    for node in walk(root) if root else ():
+        target = f" on {node['relation']}" if node["relation"] else ""
+        if node["distribution"] in COSTLY_DISTRIBUTIONS:
+            flags.add(f"{node['distribution']} {node['operator']}{target}")
+        if any(node["operator"].startswith(operator) for operator in COSTLY_OPERATORS):
+            flags.add(f"{node['operator']}{target}")
+    flags.update(f"missing statistics: {table}" for table in missing)
+    return sorted(flags)
+
+
+def registered_statements(config):
+    """
+    Return {name: (sql, params)} for every statement to analyse: the full,
+    incremental and stream inserts from sql_queries and the canned
+    analytics queries from query_service.
+    """
+    source = config.get('S3', 'EVENT_SOURCE', fallback='') or config.get('S3', 'EVENT_CSV', fallback='')
+    statements = {f"insert.{name}": (query, None) for name, (query, _) in insert_table_graph.items()}
+    statements.update((f"incremental.{name}", (query, {"source": source or SAMPLE_PARAMS["source"]}))
+                      for name, query in incremental_insert_tables.items())
+    statements.update((f"stream.{name}", (query, None)) for name, query in stream_insert_tables.items())
+    statements.update((f"query.{name}", (sql, {**SAMPLE_PARAMS, **defaults}))
+                      for name, (sql, defaults) in CANNED_QUERIES.items())
+    return statements
+
+
+def explain_statement(cur, sql, params=None):
+    """
+    EXPLAIN every step of a (possibly multi-step) statement.
+
+    Temp tables the later steps depend on are created empty, and DROPs are
+    executed, so each step plans against the tables it would see; the
+    caller rolls the transaction back. Returns a list of
+    {step, sql, cost, rows, flags, plan}.
+    """
+    steps = []
+    for number, step in enumerate(split_statements(sql), 1):
+        keyword = step.split(None, 1)[0].upper()
+        ctas = ctas_pattern.match(step)
+        if keyword in EXPLAINABLE or ctas:
+            cur.execute("EXPLAIN " + step, params)
+            root, missing = parse_plan(row[0] for row in cur.fetchall())
+            steps.append({
+                "step": number,
+                "sql": " ".join(step.split())[:80],
+                "cost": root["total_cost"] if root else 0.0,
+                "rows": root["rows"] if root else 0,
+                "flags": plan_flags(root, missing),
+                "plan": root,
+            })
+        if ctas:
+            cur.execute(f"{ctas.group(1)} SELECT * FROM ({ctas.group(2)}) AS plan_source LIMIT 0", params)
+        elif keyword not in EXPLAINABLE:
+            cur.execute(step, params)
+    return steps
+
+
+def analyse(config, names=None):
+    """
+    Plan every registered statement (or only names) and return
+    {name: {"cost", "flags", "steps"} or {"error"}}. Nothing is executed
+    beyond empty temp tables, and each statement is rolled back.
+    """
+    statements = registered_statements(config)
+    manager = get_manager(config)
+    report = {}
+    for name, (sql, params) in statements.items():
+        if names and name not in names:
+            continue
+        with manager.session() as (cur, conn):
+            try:
+                steps = explain_statement(cur, sql, params)
+                report[name] = {
+                    "cost": round(sum(step["cost"] for step in steps), 2),
+                    "flags": sorted({flag for step in steps for flag in step["flags"]}),
+                    "steps": steps,
+                }
+            except Exception as e:
+                print(f"Error planning {name}: {e}")
+                report[name] = {"error": str(e)}
+            finally:
+                conn.rollback()
+    return report
+
+
+def print_report(report):
+    """Print each statement's estimated cost and flags."""
+    for name, result in report.items():
+        if "error" in result:
+            print(f"{name}: ERROR {result['error']}")
+            continue
+        print(f"{name}: cost {result['cost']:,.2f}")
+        for flag in result["flags"]:
+            print(f"    FLAG {flag}")
+
+
+def compare_plans(report, baseline, tolerance):
+    """
+    Return the regressions of report against baseline: statements that
+    failed to plan, gained a flag, or whose estimated cost grew by more
+    than tolerance (a fraction). Statements without a baseline are new,
+    not regressions.
+    """
+    regressions = []
+    for name, result in report.items():
+        if "error" in result:
+            regressions.append((name, f"failed to plan: {result['error']}"))
+            continue
+        before = baseline.get(name)
+        if before is None:
+            print(f"NEW {name}: no baseline")
+            continue
+        for flag in sorted(set(result["flags"]) - set(before["flags"])):
+            regressions.append((name, f"new flag {flag}"))
+        if before["cost"] > 0 and result["cost"] > before["cost"] * (1 + tolerance):
+            regressions.append((name, f"cost {before['cost']:,.2f} -> {result['cost']:,.2f}"))
+    for name, reason in regressions:
+        print(f"REGRESSION {name}: {reason}")
+    return regressions
+
+
+def load_baseline(path):
+    """Read the stored plan baseline, or return an empty one if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    """
+    Plan every statement against the cluster in dwh.cfg and exit non-zero if
+    any regressed against the [PLANS] baseline; --update-baseline saves the
+    current plans as the new baseline instead. Statement names given on the
+    command line limit the check to them.
+    """
+    config = load_config('dwh.cfg')
+    plans = config['PLANS'] if config.has_section('PLANS') else {}
+    baseline_path = plans.get('BASELINE', os.path.join('plans', 'baseline.json'))
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    report = analyse(config, set(args) or None)
+    close_all()
+    print_report(report)
+
+    baseline = load_baseline(baseline_path)
+    if "--update-baseline" in sys.argv[1:]:
+        baseline.update({name: {"cost": result["cost"], "flags": result["flags"]}
+                         for name, result in report.items() if "error" not in result})
+        os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {baseline_path}")
+        return
+
+    if not baseline:
+        print(f"No baseline at {baseline_path}; run with --update-baseline to create one.")
+    if compare_plans(report, baseline, float(plans.get('COST_TOLERANCE', '0.5'))):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
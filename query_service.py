@@ -0,0 +1,226 @@
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from db_session import close_all, get_manager, load_config
+
+# End of time for the default query ranges, in epoch milliseconds
+MAX_TIME = 2 ** 62
+
+# Every QueryService in this process, so a finished load can clear them all
+_services = weakref.WeakSet()
+
+# Canned dashboard queries: name -> (SQL, default parameters). Time ranges
+# are epoch milliseconds, like songplay.start_time.
+CANNED_QUERIES = {
+    "top_songs": ("""
+        SELECT a.song_id, MAX(a.title) AS title, ar.name AS artist, SUM(a.plays) AS plays
+        FROM agg_song_plays_daily a
+        LEFT JOIN artists ar ON ar.artist_id = a.artist_id
+        WHERE a.day_start >= %(start_time)s AND a.day_start < %(end_time)s
+        GROUP BY a.song_id, ar.name
+        ORDER BY plays DESC, a.song_id
+        LIMIT %(limit)s;
+    """, {"start_time": 0, "end_time": MAX_TIME, "limit": 10}),
+    "top_artists": ("""
+        SELECT sp.artist_id, ar.name, COUNT(*) AS plays, COUNT(DISTINCT sp.user_id) AS listeners
+        FROM songplay sp
+        LEFT JOIN artists ar ON ar.artist_id = sp.artist_id
+        WHERE sp.start_time >= %(start_time)s AND sp.start_time < %(end_time)s
+        GROUP BY sp.artist_id, ar.name
+        ORDER BY plays DESC, sp.artist_id
+        LIMIT %(limit)s;
+    """, {"start_time": 0, "end_time": MAX_TIME, "limit": 10}),
+    "active_users_hourly": ("""
+        SELECT hour_start, year, month, day, hour,
+               SUM(active_users) AS active_users, SUM(free_users) AS free_users,
+               SUM(paid_users) AS paid_users, SUM(plays) AS plays
+        FROM agg_active_users_hourly
+        WHERE hour_start >= %(start_time)s AND hour_start < %(end_time)s
+        GROUP BY hour_start, year, month, day, hour
+        ORDER BY hour_start;
+    """, {"start_time": 0, "end_time": MAX_TIME}),
+    "level_by_location": ("""
+        SELECT location,
+               SUM(CASE WHEN level = 'free' THEN plays ELSE 0 END) AS free_plays,
+               SUM(CASE WHEN level = 'paid' THEN plays ELSE 0 END) AS paid_plays,
+               SUM(plays) AS plays
+        FROM agg_level_location_daily
+        WHERE day_start >= %(start_time)s AND day_start < %(end_time)s
+        GROUP BY location
+        ORDER BY plays DESC, location
+        LIMIT %(limit)s;
+    """, {"start_time": 0, "end_time": MAX_TIME, "limit": 20}),
+    "user_history": ("""
+        SELECT sp.start_time, s.title, ar.name AS artist, sp.level, sp.session_id
+        FROM songplay sp
+        LEFT JOIN songs s ON s.song_id = sp.song_id
+        LEFT JOIN artists ar ON ar.artist_id = sp.artist_id
+        WHERE sp.user_id = %(user_id)s
+        ORDER BY sp.start_time DESC
+        LIMIT %(limit)s;
+    """, {"limit": 50}),
+    "users_by_level": ("""
+        SELECT level, gender, COUNT(*) AS users
+        FROM users
+        GROUP BY level, gender
+        ORDER BY level, gender;
+    """, {}),
+}
+
+
+def normalise_sql(sql):
+    """Collapse whitespace and drop the trailing semicolon, leaving quoted literals alone."""
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(";"))
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+def cache_key(sql, params):
+    """Key a query result on its normalised SQL and its parameters."""
+    return normalise_sql(sql), tuple(sorted((name, repr(value)) for name, value in (params or {}).items()))
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of query results whose entries expire after ttl seconds.
+
+    The least recently used entry is evicted once maxsize entries are held.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+def load_marker_path(config):
+    """Return the file the ETL touches when a load finishes."""
+    return config.get('QUERY', 'LOAD_MARKER', fallback=os.path.join('metrics', 'last_load'))
+
+
+def notify_load_finished(config):
+    """
+    Record that a load has finished, so every QueryService drops its cached
+    results, in this process straight away and in others on their next query.
+    """
+    path = load_marker_path(config)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(f"{time.time()}\n")
+    os.replace(path + ".tmp", path)
+    for service in list(_services):
+        service.invalidate()
+
+
+class QueryService:
+    """
+    Run canned or ad-hoc analytics queries on pooled connections, serving
+    repeats from an in-memory result cache until they expire or a load
+    finishes.
+    """
+
+    def __init__(self, config):
+        query = config['QUERY'] if config.has_section('QUERY') else {}
+        self.manager = get_manager(config)
+        self.cache = ResultCache(int(query.get('CACHE_SIZE', '256')), float(query.get('CACHE_TTL_SECONDS', '300')))
+        self.marker = load_marker_path(config)
+        self._marker_mtime = self._load_marker_mtime()
+        self._generation = 0
+        _services.add(self)
+
+    def _load_marker_mtime(self):
+        """Return the load marker's modification time, or None if no load has finished yet."""
+        try:
+            return os.stat(self.marker).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def invalidate(self):
+        """Drop every cached result."""
+        self._generation += 1
+        self.cache.clear()
+
+    def _check_for_new_load(self):
+        """Clear the cache if a load finished since the last check."""
+        mtime = self._load_marker_mtime()
+        if mtime != self._marker_mtime:
+            self._marker_mtime = mtime
+            self.invalidate()
+
+    def query(self, sql, params=None):
+        """Run a query and return (columns, rows), from the cache when possible."""
+        self._check_for_new_load()
+        key = cache_key(sql, params)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        generation = self._generation
+        with self.manager.session() as (cur, conn):
+            cur.execute(sql, params)
+            result = ([column[0] for column in cur.description], cur.fetchall())
+            conn.rollback()
+        # A result read while a load was finishing may already be stale
+        if generation == self._generation:
+            self.cache.put(key, result)
+        return result
+
+    def run(self, name, **params):
+        """Run the canned query name with params over its defaults."""
+        sql, defaults = CANNED_QUERIES[name]
+        return self.query(sql, {**defaults, **params})
+
+
+def main():
+    """Run a canned query twice and show both timings: query_service.py <name> [param=value ...]"""
+    if len(sys.argv) < 2 or sys.argv[1] not in CANNED_QUERIES:
+        print(f"Usage: query_service.py <{'|'.join(CANNED_QUERIES)}> [param=value ...]")
+        sys.exit(1)
+    params = {}
+    for arg in sys.argv[2:]:
+        name, value = arg.split("=", 1)
+        params[name] = int(value) if value.lstrip("-").isdigit() else value
+
+    service = QueryService(load_config('dwh.cfg'))
+    for attempt in ("database", "cache"):
+        start = time.perf_counter()
+        columns, rows = service.run(sys.argv[1], **params)
+        print(f"{len(rows)} rows from the {attempt} in {(time.perf_counter() - start) * 1000:.2f}ms")
+    print(" | ".join(columns))
+    for row in rows:
+        print(" | ".join(str(value) for value in row))
+    close_all()
+
+
+if __name__ == "__main__":
+    main()
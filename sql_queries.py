@@ -13,6 +13,11 @@ user_table_drop = "DROP TABLE IF EXISTS users cascade;"
 song_table_drop = "DROP TABLE IF EXISTS songs cascade;"
 artist_table_drop = "DROP TABLE IF EXISTS artists cascade;"
 time_table_drop = "DROP TABLE IF EXISTS time cascade;"
+load_watermark_table_drop = "DROP TABLE IF EXISTS load_watermark cascade;"
+song_lookup_table_drop = "DROP TABLE IF EXISTS song_lookup cascade;"
+agg_song_plays_daily_table_drop = "DROP TABLE IF EXISTS agg_song_plays_daily cascade;"
+agg_active_users_hourly_table_drop = "DROP TABLE IF EXISTS agg_active_users_hourly cascade;"
+agg_level_location_daily_table_drop = "DROP TABLE IF EXISTS agg_level_location_daily cascade;"
 
 # CREATE TABLES
 
@@ -54,6 +59,43 @@ staging_songs_table_create = ("""
     );
 """)
 
+# Column types of the staging tables above, in DDL order. Used by loaders
+# that stream or validate local files before they reach the warehouse.
+staging_column_types = {
+    "staging_events": {
+        "artist": "text",
+        "auth": "text",
+        "firstName": "text",
+        "gender": "text",
+        "itemInSession": "bigint",
+        "lastName": "text",
+        "length": "float",
+        "level": "text",
+        "location": "text",
+        "method": "text",
+        "page": "text",
+        "registration": "numeric",
+        "sessionId": "bigint",
+        "song": "text",
+        "status": "bigint",
+        "ts": "bigint",
+        "userAgent": "text",
+        "userId": "bigint",
+    },
+    "staging_songs": {
+        "artist_id": "text",
+        "artist_latitude": "float",
+        "artist_longitude": "float",
+        "artist_location": "text",
+        "artist_name": "text",
+        "song_id": "text",
+        "num_songs": "int",
+        "title": "text",
+        "duration": "float",
+        "year": "int",
+    },
+}
+
 songplay_table_create = ("""
     CREATE TABLE IF NOT EXISTS songplay (
         songplay_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
@@ -110,6 +152,79 @@ time_table_create = ("""
     );
 """)
 
+load_watermark_table_create = ("""
+    CREATE TABLE IF NOT EXISTS load_watermark (
+        source text NOT NULL,
+        max_ts bigint NOT NULL,
+        loaded_at timestamp NOT NULL
+    );
+""")
+
+song_lookup_table_create = ("""
+    CREATE TABLE IF NOT EXISTS song_lookup (
+        song_key bigint NOT NULL,
+        song_id text NOT NULL,
+        artist_id text NOT NULL
+    );
+""")
+
+# AGGREGATE TABLES
+# Pre-aggregated rollups of songplay for dashboards. day_start/hour_start
+# are the start of the UTC day/hour in epoch milliseconds, like start_time.
+
+agg_song_plays_daily_table_create = ("""
+    CREATE TABLE IF NOT EXISTS agg_song_plays_daily (
+        day_start bigint NOT NULL,
+        year int NOT NULL,
+        month int NOT NULL,
+        day int NOT NULL,
+        song_id text NOT NULL,
+        artist_id text NOT NULL,
+        title text,
+        plays bigint NOT NULL,
+        listeners bigint NOT NULL
+    );
+""")
+
+agg_active_users_hourly_table_create = ("""
+    CREATE TABLE IF NOT EXISTS agg_active_users_hourly (
+        hour_start bigint NOT NULL,
+        year int NOT NULL,
+        month int NOT NULL,
+        day int NOT NULL,
+        hour int NOT NULL,
+        gender text,
+        active_users bigint NOT NULL,
+        free_users bigint NOT NULL,
+        paid_users bigint NOT NULL,
+        plays bigint NOT NULL
+    );
+""")
+
+agg_level_location_daily_table_create = ("""
+    CREATE TABLE IF NOT EXISTS agg_level_location_daily (
+        day_start bigint NOT NULL,
+        year int NOT NULL,
+        month int NOT NULL,
+        day int NOT NULL,
+        location text NOT NULL,
+        level text NOT NULL,
+        plays bigint NOT NULL,
+        listeners bigint NOT NULL,
+        sessions bigint NOT NULL
+    );
+""")
+
+# SONG LOOKUP KEY
+# 64-bit FNV hash of the lower-cased, trimmed title and artist name. The
+# songplay build joins events to song_lookup on this integer instead of
+# comparing two free-text columns.
+
+def song_key(title, artist):
+    """Return the SQL expression hashing a title/artist column pair."""
+    return f"FNV_HASH(LOWER(TRIM({title})), FNV_HASH(LOWER(TRIM({artist}))))"
+
+
 # STAGING TABLES
 
 #staging_events_copy = ("""
@@ -128,60 +243,164 @@ time_table_create = ("""
 
 # FINAL TABLES
 
+def merge_query(table, key, columns, source, order_by):
+    """
+    Build a staged merge of source into table.
+
+    source is de-duplicated to one row per key (the first by order_by) in a
+    temp table, then matching rows are replaced with one set-based DELETE
+    and INSERT. Existing rows are updated (e.g. a user's level going from
+    free to paid) and repeated loads never duplicate a key.
+    """
+    cols = ", ".join(columns)
+    return f"""
+    DROP TABLE IF EXISTS {table}_merge;
+
+    CREATE TEMP TABLE {table}_merge AS
+        SELECT {cols}
+        FROM (
+            SELECT src.*, ROW_NUMBER() OVER (PARTITION BY src.{key} ORDER BY {order_by}) AS rn
+            FROM ({source}) src
+        ) ranked
+        WHERE ranked.rn = 1;
+
+    DELETE FROM {table}
+        USING {table}_merge
+        WHERE {table}.{key} = {table}_merge.{key};
+
+    INSERT INTO {table} ({cols})
+        SELECT {cols} FROM {table}_merge;
+"""
+
+
+DAY_MS = 86400000
+HOUR_MS = 3600000
+
+
+def aggregate_refresh_query(table, bucket, bucket_ms, columns, select, source="staging"):
+    """
+    Build an incremental refresh of an aggregate table over songplay.
+
+    The buckets (UTC days or hours of start_time) holding the events just
+    staged are collected in a temp table; their aggregate rows are deleted
+    and recomputed from the songplay rows in those buckets alone, found
+    through the start_time sort key. Whole buckets are recomputed because
+    distinct counts cannot be summed from deltas. select must group by the
+    bucket and filter songplay sp with {scope}. With source="incremental"
+    only staged events beyond the %(source)s watermark count, and with
+    source="songplay" every bucket is rebuilt.
+    """
+    cols = ", ".join(columns)
+    if source in ("staging", "incremental"):
+        buckets = f"""SELECT DISTINCT se.ts / {bucket_ms} * {bucket_ms} AS {bucket}
+        FROM staging_events se
+        WHERE se.page = 'NextSong' AND se.ts IS NOT NULL"""
+        if source == "incremental":
+            buckets += """
+            AND se.ts > (
+                SELECT COALESCE(MAX(lw.max_ts), 0) FROM load_watermark lw WHERE lw.source = %(source)s
+            )"""
+    else:
+        buckets = f"""SELECT DISTINCT sp.start_time / {bucket_ms} * {bucket_ms} AS {bucket}
+        FROM songplay sp"""
+    scope = f"""sp.start_time >= (SELECT MIN({bucket}) FROM {table}_buckets)
+            AND sp.start_time < (SELECT MAX({bucket}) FROM {table}_buckets) + {bucket_ms}
+            AND sp.start_time / {bucket_ms} * {bucket_ms} IN (SELECT {bucket} FROM {table}_buckets)"""
+    return f"""
+    DROP TABLE IF EXISTS {table}_buckets;
+
+    CREATE TEMP TABLE {table}_buckets AS
+        {buckets};
+
+    DELETE FROM {table}
+        USING {table}_buckets
+        WHERE {table}.{bucket} = {table}_buckets.{bucket};
+
+    INSERT INTO {table} ({cols})
+        {select.strip().format(scope=scope)};
+"""
+
+
+song_lookup_insert = ("""
+    INSERT INTO song_lookup (song_key, song_id, artist_id)
+        SELECT k.song_key, k.song_id, k.artist_id
+        FROM (
+            SELECT
+                {key} AS song_key,
+                ss.song_id,
+                ss.artist_id,
+                ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY ss.song_id) AS rn
+            FROM staging_songs ss
+            WHERE ss.title IS NOT NULL AND ss.artist_name IS NOT NULL
+        ) k
+        LEFT JOIN song_lookup sl ON sl.song_key = k.song_key
+        WHERE k.rn = 1
+            AND sl.song_key IS NULL;
+""").format(key=song_key("ss.title", "ss.artist_name"))
+
+# Every day staged replaces that day's songplay rows. Changed partitions are
+# restaged whole, so deleting their days first (in the same transaction, via
+# the start_time sort key) keeps a reload from duplicating rows.
 songplay_table_insert = ("""
+    DROP TABLE IF EXISTS songplay_days;
+
+    CREATE TEMP TABLE songplay_days AS
+        SELECT DISTINCT se.ts / {day_ms} * {day_ms} AS day_start
+        FROM staging_events se
+        WHERE se.page = 'NextSong' AND se.ts IS NOT NULL;
+
+    DELETE FROM songplay
+        WHERE start_time >= (SELECT MIN(day_start) FROM songplay_days)
+            AND start_time < (SELECT MAX(day_start) FROM songplay_days) + {day_ms}
+            AND start_time / {day_ms} * {day_ms} IN (SELECT day_start FROM songplay_days);
+
     INSERT INTO songplay (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
         SELECT 
             se.ts AS start_time,
             se.userId AS user_id,
             se.level,
-            ss.song_id,
-            ss.artist_id,
+            sl.song_id,
+            sl.artist_id,
             se.sessionId AS session_id,
             se.location,
             se.userAgent AS user_agent
         FROM staging_events se
-        JOIN staging_songs ss
-            ON se.song = ss.title AND se.artist = ss.artist_name
+        JOIN song_lookup sl
+            ON sl.song_key = {key}
         WHERE se.page = 'NextSong';
-""")
+""").format(key=song_key("se.song", "se.artist"), day_ms=DAY_MS)
 
-user_table_insert = ("""
-    INSERT INTO users (user_id, firstName, lastName, gender, level)
-        SELECT 
-            se.userId AS user_id,
-            se.firstName AS first_name,
-            se.lastName AS last_name,
-            se.gender,
-            se.level
-        FROM staging_events se
-        WHERE se.userId IS NOT NULL
-            AND se.page = 'NextSong'
-            AND NOT EXISTS (
-                SELECT 1 FROM users u WHERE u.user_id = se.userId
-            );
-""")
+user_table_insert = merge_query(
+    "users", "user_id", ["user_id", "firstName", "lastName", "gender", "level"],
+    """
+            SELECT se.userId AS user_id, se.firstName, se.lastName, se.gender, se.level, se.ts
+            FROM staging_events se
+            WHERE se.userId IS NOT NULL
+                AND se.page = 'NextSong'
+    """,
+    "ts DESC"
+)
 
-song_table_insert = ("""
-    INSERT INTO songs (song_id, title, artist_id, year, duration)
-        SELECT DISTINCT 
-            ss.song_id,
-            ss.title,
-            ss.artist_id,
-            ss.year,
-            ss.duration
-        FROM staging_songs ss;
-""")
+song_table_insert = merge_query(
+    "songs", "song_id", ["song_id", "title", "artist_id", "year", "duration"],
+    """
+            SELECT ss.song_id, ss.title, ss.artist_id, ss.year, ss.duration
+            FROM staging_songs ss
+            WHERE ss.song_id IS NOT NULL
+    """,
+    "year DESC, duration DESC"
+)
 
-artist_table_insert = ("""
-    INSERT INTO artists (artist_id, name, location, latitude, longitude)
-        SELECT DISTINCT 
-            ss.artist_id,
-            ss.artist_name AS name,
-            ss.artist_location AS location,
-            ss.artist_latitude AS latitude,
-            ss.artist_longitude AS longitude
-        FROM staging_songs ss;
-""")
+artist_table_insert = merge_query(
+    "artists", "artist_id", ["artist_id", "name", "location", "latitude", "longitude"],
+    """
+            SELECT ss.artist_id, ss.artist_name AS name, ss.artist_location AS location,
+                ss.artist_latitude AS latitude, ss.artist_longitude AS longitude
+            FROM staging_songs ss
+            WHERE ss.artist_id IS NOT NULL
+    """,
+    "latitude NULLS LAST, location NULLS LAST, name"
+)
 
 time_table_insertOLD = ("""
     INSERT INTO time (start_time, hour, day, week, month, year, weekday)
@@ -199,21 +418,256 @@ time_table_insertOLD = ("""
 
 time_table_insert = ("""
 INSERT INTO time (starttime, hour, day, week, month, year, weekday)
-SELECT DISTINCT
-       se.ts AS starttime,
-       EXTRACT(HOUR FROM TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second') AS hour,
-       EXTRACT(DAY FROM TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second') AS day,
-       EXTRACT(WEEK FROM TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second') AS week,
-       EXTRACT(MONTH FROM TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second') AS month,
-       EXTRACT(YEAR FROM TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second') AS year,
-       EXTRACT(DOW FROM TIMESTAMP 'epoch' + se.ts / 1000 * INTERVAL '1 second') AS weekday
-FROM staging_events se;
+WITH new_ts AS (
+    SELECT DISTINCT se.ts
+    FROM staging_events se
+    WHERE se.page = 'NextSong'
+        AND se.ts IS NOT NULL
+), converted AS (
+    SELECT n.ts, TIMESTAMP 'epoch' + n.ts / 1000 * INTERVAL '1 second' AS start_ts
+    FROM new_ts n
+    LEFT JOIN time t ON t.starttime = n.ts
+    WHERE t.starttime IS NULL
+)
+SELECT c.ts AS starttime,
+       EXTRACT(HOUR FROM c.start_ts) AS hour,
+       EXTRACT(DAY FROM c.start_ts) AS day,
+       EXTRACT(WEEK FROM c.start_ts) AS week,
+       EXTRACT(MONTH FROM c.start_ts) AS month,
+       EXTRACT(YEAR FROM c.start_ts) AS year,
+       EXTRACT(DOW FROM c.start_ts) AS weekday
+FROM converted c;
+""")
+
+aggregate_refreshes = {
+    "agg_song_plays_daily": dict(
+        bucket="day_start", bucket_ms=DAY_MS,
+        columns=["day_start", "year", "month", "day", "song_id", "artist_id", "title", "plays", "listeners"],
+        select=f"""
+        SELECT sp.start_time / {DAY_MS} * {DAY_MS} AS day_start, t.year, t.month, t.day,
+               sp.song_id, sp.artist_id, s.title,
+               COUNT(*) AS plays, COUNT(DISTINCT sp.user_id) AS listeners
+        FROM songplay sp
+        JOIN time t ON t.starttime = sp.start_time
+        LEFT JOIN songs s ON s.song_id = sp.song_id
+        WHERE {{scope}}
+        GROUP BY 1, 2, 3, 4, 5, 6, 7"""
+    ),
+    "agg_active_users_hourly": dict(
+        bucket="hour_start", bucket_ms=HOUR_MS,
+        columns=["hour_start", "year", "month", "day", "hour", "gender",
+                 "active_users", "free_users", "paid_users", "plays"],
+        select=f"""
+        SELECT sp.start_time / {HOUR_MS} * {HOUR_MS} AS hour_start, t.year, t.month, t.day, t.hour, u.gender,
+               COUNT(DISTINCT sp.user_id) AS active_users,
+               COUNT(DISTINCT CASE WHEN sp.level = 'free' THEN sp.user_id END) AS free_users,
+               COUNT(DISTINCT CASE WHEN sp.level = 'paid' THEN sp.user_id END) AS paid_users,
+               COUNT(*) AS plays
+        FROM songplay sp
+        JOIN time t ON t.starttime = sp.start_time
+        LEFT JOIN users u ON u.user_id = sp.user_id
+        WHERE {{scope}}
+        GROUP BY 1, 2, 3, 4, 5, 6"""
+    ),
+    "agg_level_location_daily": dict(
+        bucket="day_start", bucket_ms=DAY_MS,
+        columns=["day_start", "year", "month", "day", "location", "level", "plays", "listeners", "sessions"],
+        select=f"""
+        SELECT sp.start_time / {DAY_MS} * {DAY_MS} AS day_start, t.year, t.month, t.day,
+               sp.location, sp.level,
+               COUNT(*) AS plays, COUNT(DISTINCT sp.user_id) AS listeners,
+               COUNT(DISTINCT sp.session_id) AS sessions
+        FROM songplay sp
+        JOIN time t ON t.starttime = sp.start_time
+        WHERE {{scope}}
+        GROUP BY 1, 2, 3, 4, 5, 6"""
+    ),
+}
+
+# Refresh from the buckets of the staged events (after each load), of the
+# staged events beyond the watermark (incremental loads), or rebuild every
+# bucket (first build, or after songplay was reloaded)
+aggregate_refresh_queries = {
+    name: aggregate_refresh_query(name, **spec) for name, spec in aggregate_refreshes.items()
+}
+aggregate_incremental_queries = {
+    name: aggregate_refresh_query(name, source="incremental", **spec) for name, spec in aggregate_refreshes.items()
+}
+aggregate_rebuild_queries = {
+    name: aggregate_refresh_query(name, source="songplay", **spec) for name, spec in aggregate_refreshes.items()
+}
+
+# Insert the rows of a client-built time_load table (see
+# local_loader.load_time_dimension) that time does not already have.
+time_load_table_create = ("""
+    CREATE TEMP TABLE time_load (LIKE time);
+""")
+
+time_table_insert_from_load = ("""
+INSERT INTO time (starttime, hour, day, week, month, year, weekday)
+SELECT tl.starttime, tl.hour, tl.day, tl.week, tl.month, tl.year, tl.weekday
+FROM time_load tl
+LEFT JOIN time t ON t.starttime = tl.starttime
+WHERE t.starttime IS NULL;
+""")
+
+# INCREMENTAL INSERTS
+# Only staging_events rows beyond the persisted high-water mark for the
+# current source are processed. %(source)s identifies the file/batch.
+
+load_watermark_select = ("""
+    SELECT COALESCE(MAX(max_ts), 0) FROM load_watermark WHERE source = %(source)s;
+""")
+
+# Staging tables are replaced, not appended to, on every load: each COPY
+# runs in the same transaction as the DELETE that empties its table
+clear_staging_events = "DELETE FROM staging_events;"
+clear_staging_songs = "DELETE FROM staging_songs;"
+clear_staging_tables = {"staging_events": clear_staging_events, "staging_songs": clear_staging_songs}
+
+load_watermark_update = ("""
+    INSERT INTO load_watermark (source, max_ts, loaded_at)
+        SELECT %(source)s, MAX(se.ts), CURRENT_TIMESTAMP
+        FROM staging_events se
+        HAVING MAX(se.ts) > (
+            SELECT COALESCE(MAX(lw.max_ts), 0) FROM load_watermark lw WHERE lw.source = %(source)s
+        );
+""")
+
+songplay_table_insert_incremental = ("""
+    INSERT INTO songplay (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+        SELECT 
+            se.ts AS start_time,
+            se.userId AS user_id,
+            se.level,
+            sl.song_id,
+            sl.artist_id,
+            se.sessionId AS session_id,
+            se.location,
+            se.userAgent AS user_agent
+        FROM staging_events se
+        JOIN song_lookup sl
+            ON sl.song_key = {key}
+        WHERE se.page = 'NextSong'
+            AND se.ts > (
+                SELECT COALESCE(MAX(lw.max_ts), 0) FROM load_watermark lw WHERE lw.source = %(source)s
+            );
+""").format(key=song_key("se.song", "se.artist"))
+
+user_table_insert_incremental = merge_query(
+    "users", "user_id", ["user_id", "firstName", "lastName", "gender", "level"],
+    """
+            SELECT se.userId AS user_id, se.firstName, se.lastName, se.gender, se.level, se.ts
+            FROM staging_events se
+            WHERE se.userId IS NOT NULL
+                AND se.page = 'NextSong'
+                AND se.ts > (
+                    SELECT COALESCE(MAX(lw.max_ts), 0) FROM load_watermark lw WHERE lw.source = %(source)s
+                )
+    """,
+    "ts DESC"
+)
+
+# staging_songs is emptied in the same transaction as every COPY into it
+# (ETL.load_staging_tables, pipeline_runner), so it holds only the current
+# song files and the full merges rank just those rows
+song_table_insert_incremental = song_table_insert
+
+artist_table_insert_incremental = artist_table_insert
+
+time_table_insert_incremental = ("""
+INSERT INTO time (starttime, hour, day, week, month, year, weekday)
+WITH new_ts AS (
+    SELECT DISTINCT se.ts
+    FROM staging_events se
+    WHERE se.page = 'NextSong'
+        AND se.ts > (
+            SELECT COALESCE(MAX(lw.max_ts), 0) FROM load_watermark lw WHERE lw.source = %(source)s
+        )
+), converted AS (
+    SELECT n.ts, TIMESTAMP 'epoch' + n.ts / 1000 * INTERVAL '1 second' AS start_ts
+    FROM new_ts n
+    LEFT JOIN time t ON t.starttime = n.ts
+    WHERE t.starttime IS NULL
+)
+SELECT c.ts AS starttime,
+       EXTRACT(HOUR FROM c.start_ts) AS hour,
+       EXTRACT(DAY FROM c.start_ts) AS day,
+       EXTRACT(WEEK FROM c.start_ts) AS week,
+       EXTRACT(MONTH FROM c.start_ts) AS month,
+       EXTRACT(YEAR FROM c.start_ts) AS year,
+       EXTRACT(DOW FROM c.start_ts) AS weekday
+FROM converted c;
 """)
 
 
+# Micro-batches (stream_ingest.py) can arrive late or twice, so instead of
+# a watermark, songplay skips the staged events it already holds, matched on
+# (start_time, user_id, session_id). The users, time and aggregate inserts
+# are already safe to repeat.
+songplay_table_insert_stream = ("""
+    INSERT INTO songplay (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+        SELECT DISTINCT
+            se.ts AS start_time,
+            se.userId AS user_id,
+            se.level,
+            sl.song_id,
+            sl.artist_id,
+            se.sessionId AS session_id,
+            se.location,
+            se.userAgent AS user_agent
+        FROM staging_events se
+        JOIN song_lookup sl
+            ON sl.song_key = {key}
+        LEFT JOIN songplay sp
+            ON sp.start_time = se.ts
+            AND sp.user_id = se.userId
+            AND sp.session_id = se.sessionId
+        WHERE se.page = 'NextSong'
+            AND sp.start_time IS NULL;
+""").format(key=song_key("se.song", "se.artist"))
+
+# Staged events songplay_table_insert_stream would insert if none were loaded yet
+songplay_stream_staged = ("""
+    SELECT COUNT(*)
+    FROM staging_events se
+    JOIN song_lookup sl
+        ON sl.song_key = {key}
+    WHERE se.page = 'NextSong';
+""").format(key=song_key("se.song", "se.artist"))
+
+
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, load_watermark_table_create, song_lookup_table_create, agg_song_plays_daily_table_create, agg_active_users_hourly_table_create, agg_level_location_daily_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, load_watermark_table_drop, song_lookup_table_drop, agg_song_plays_daily_table_drop, agg_active_users_hourly_table_drop, agg_level_location_daily_table_drop]
 #copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+insert_table_queries = [song_lookup_insert, songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+incremental_insert_tables = {
+    "song_lookup": song_lookup_insert,
+    "songplay": songplay_table_insert_incremental,
+    "users": user_table_insert_incremental,
+    "songs": song_table_insert_incremental,
+    "artists": artist_table_insert_incremental,
+    "time": time_table_insert_incremental,
+    **aggregate_incremental_queries,
+}
+stream_insert_tables = {
+    "songplay": songplay_table_insert_stream,
+    "users": user_table_insert,
+    "time": time_table_insert,
+    **aggregate_refresh_queries,
+}
+
+# Dependency graph over the inserts: name -> (query, [names it must wait for]).
+# songplay joins through song_lookup; the dimensions only read staging tables;
+# the aggregates read songplay and the dimensions once they are loaded.
+insert_table_graph = {
+    "song_lookup": (song_lookup_insert, []),
+    "songplay": (songplay_table_insert, ["song_lookup"]),
+    "users": (user_table_insert, []),
+    "songs": (song_table_insert, []),
+    "artists": (artist_table_insert, []),
+    "time": (time_table_insert, []),
+    **{name: (query, ["songplay", "time", "users", "songs"]) for name, query in aggregate_refresh_queries.items()},
+}
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from Create_S3_Buckets import manifest_key_for, split_and_compress, upload_parts, write_manifest
+from ETL import build_copy_query
+from db_session import close_all, get_manager, load_config
+from instrumentation import configure, execute_statement, write_prometheus
+from local_loader import load_csv_to_staging
+from query_service import notify_load_finished
+from sql_queries import clear_staging_events, songplay_stream_staged, stream_insert_tables
+
+EVENT_SUFFIXES = (".csv", ".csv.gz")
+REJECT_SUFFIX = ".rejects.csv"
+
+
+async def discover_files(inbox, file_queue, poll_seconds, stop):
+    """
+    Poll inbox for new event files and queue each one once.
+
+    A file is queued only after its size is unchanged across two polls, so
+    files still being written are left alone; writers that create files
+    under a temporary name and rename them are picked up on the next poll.
+    """
+    sizes, queued = {}, set()
+    while not stop.is_set():
+        names = {name for name in os.listdir(inbox)
+                 if name.endswith(EVENT_SUFFIXES) and not name.endswith(REJECT_SUFFIX)}
+        for name in sorted(names - queued):
+            path = os.path.join(inbox, name)
+            size = os.path.getsize(path)
+            if sizes.get(name) == size:
+                await file_queue.put(path)
+                queued.add(name)
+            sizes[name] = size
+        queued &= names
+        try:
+            await asyncio.wait_for(stop.wait(), poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+    await file_queue.put(None)
+
+
+async def batch_files(file_queue, batch_queue, max_bytes, max_seconds):
+    """
+    Group queued files into micro-batches.
+
+    A batch is closed once it holds max_bytes or its first file has waited
+    max_seconds, whichever comes first. None on the input flushes and ends.
+    """
+    batch, size, deadline = [], 0, None
+    while True:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            path = await asyncio.wait_for(file_queue.get(), timeout)
+            expired = False
+        except asyncio.TimeoutError:
+            path, expired = "", True
+
+        if path:
+            if not batch:
+                deadline = time.monotonic() + max_seconds
+            batch.append(path)
+            size += os.path.getsize(path)
+
+        if batch and (path is None or expired or size >= max_bytes):
+            await batch_queue.put(batch)
+            batch, size, deadline = [], 0, None
+        if path is None:
+            await batch_queue.put(None)
+            return
+
+
+def upload_batch(s3_client, bucket_name, prefix, batch):
+    """Gzip (if needed) and upload a batch, returning its quoted manifest URL."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        parts = [
+            path if path.endswith(".gz") else split_and_compress(path, 1, tmp_dir)[0]
+            for path in batch
+        ]
+        keys = upload_parts(s3_client, bucket_name, parts, prefix)
+    return f"'{write_manifest(s3_client, bucket_name, manifest_key_for(prefix, 'events'), keys)}'"
+
+
+async def stage_batches(batch_queue, load_queue, s3_client, bucket_name, prefix):
+    """Upload each batch to S3 while the previous one is loading."""
+    while True:
+        batch = await batch_queue.get()
+        if batch is None:
+            await load_queue.put(None)
+            return
+        source = None
+        if s3_client is not None:
+            batch_prefix = f"{prefix}/batch-{time.strftime('%Y%m%dT%H%M%S')}-{len(batch)}"
+            try:
+                source = await asyncio.to_thread(upload_batch, s3_client, bucket_name, batch_prefix, batch)
+            except Exception as e:
+                print(f"Error uploading batch: {e}")
+                await load_queue.put((batch, e))
+                continue
+        await load_queue.put((batch, source))
+
+
+def insert_batch(cur, conn):
+    """
+    Insert the staged batch into the analytics tables in one transaction.
+
+    Only the event-driven inserts run (see sql_queries.stream_insert_tables);
+    the song catalogue in staging_songs does not change between batches.
+    Events songplay already holds are skipped, so a late file still loads
+    its new rows and a repeated one loads nothing. Returns the number of
+    staged events skipped.
+    """
+    try:
+        cur.execute(songplay_stream_staged)
+        staged = cur.fetchone()[0]
+        inserted = 0
+        for name, query in stream_insert_tables.items():
+            rows = execute_statement(cur, conn, "stream", name, query, commit=False)
+            if name == "songplay":
+                inserted = rows
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return staged - inserted
+
+
+def load_batch(config, manager, batch, source, reject_dir):
+    """
+    Replace staging_events with one batch and insert it.
+
+    The batch is COPYed from its S3 manifest when source is set, otherwise
+    streamed from the local files, with rejected rows written to
+    reject_dir, outside the inbox. Returns the number of events skipped as
+    already loaded.
+    """
+    with manager.session() as (cur, conn):
+        execute_statement(cur, conn, "stream", "clear_staging_events", clear_staging_events)
+        if source:
+            query = build_copy_query("staging_events", source, config['IAM_ROLE']['ARN'], "GZIP")
+            execute_statement(cur, conn, "stream", "staging_events", query, copy=True)
+        else:
+            for path in batch:
+                name = os.path.splitext(os.path.basename(path).removesuffix(".gz"))[0]
+                load_csv_to_staging("staging_events", path, cur, conn,
+                                    reject_file=os.path.join(reject_dir, name + REJECT_SUFFIX))
+        return insert_batch(cur, conn)
+
+
+async def load_batches(load_queue, config, manager, processed_dir, failed_dir):
+    """Load batches one at a time and move their files to processed or failed."""
+    while True:
+        item = await load_queue.get()
+        if item is None:
+            return
+        batch, source = item
+        target = processed_dir
+        try:
+            if isinstance(source, Exception):
+                raise source
+            start = time.perf_counter()
+            skipped = await asyncio.to_thread(load_batch, config, manager, batch, source, failed_dir)
+            notify_load_finished(config)
+            print(f"Loaded batch of {len(batch)} files in {time.perf_counter() - start:.2f}s" +
+                  (f", skipped {skipped} events already loaded." if skipped else "."))
+        except Exception as e:
+            print(f"Error loading batch {batch}: {e}")
+            target = failed_dir
+        for path in batch:
+            shutil.move(path, os.path.join(target, os.path.basename(path)))
+        write_prometheus()
+
+
+async def run(config):
+    """
+    Run discovery, batching, upload and load concurrently until SIGINT/SIGTERM.
+
+    Each stage hands work to the next through a small bounded queue, so a
+    batch can upload while the previous one is loading.
+    """
+    stream = config['STREAM']
+    inbox = stream.get('INBOX', os.path.join('data', 'inbox'))
+    processed_dir = stream.get('PROCESSED_DIR', os.path.join(inbox, 'processed'))
+    failed_dir = stream.get('FAILED_DIR', os.path.join(inbox, 'failed'))
+    for directory in (inbox, processed_dir, failed_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    s3_client = None
+    bucket_name = stream.get('BUCKET', '')
+    if bucket_name:
+        import boto3
+        s3_client = boto3.client('s3', endpoint_url=stream.get('S3_ENDPOINT_URL') or None)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    file_queue, batch_queue, load_queue = asyncio.Queue(), asyncio.Queue(2), asyncio.Queue(1)
+    print(f"Watching {inbox} for event files...")
+    await asyncio.gather(
+        discover_files(inbox, file_queue, float(stream.get('POLL_SECONDS', '5')), stop),
+        batch_files(file_queue, batch_queue, int(stream.get('BATCH_MAX_BYTES', str(128 * 1024 * 1024))),
+                    float(stream.get('BATCH_MAX_SECONDS', '60'))),
+        stage_batches(batch_queue, load_queue, s3_client, bucket_name, stream.get('PREFIX', 'stream')),
+        load_batches(load_queue, config, get_manager(config), processed_dir, failed_dir),
+    )
+
+
+def main():
+    """Start micro-batch ingestion as configured in the [STREAM] section of dwh.cfg."""
+    config = load_config('dwh.cfg')
+    configure(config)
+    asyncio.run(run(config))
+    close_all()
+    print("Stream ingestion stopped.")
+
+
+if __name__ == "__main__":
+    main()
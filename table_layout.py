@@ -0,0 +1,176 @@
+import re
+
+from db_session import close_all, get_manager, load_config
+from sql_queries import create_table_queries
+
+# Physical layout of each table. Small dimensions are copied to every node
+# (ALL) so joins against them never move data; the fact table and the
+# potentially large songs dimension are co-located on song_id. The compact
+# song_lookup table is copied everywhere too, so the songplay build joins it
+# without redistributing staging_events. The aggregates are sorted on their
+# time bucket, which dashboards filter on and refreshes delete by. Tables not
+# listed keep Redshift's AUTO distribution.
+TABLE_LAYOUTS = {
+    "songplay": {"diststyle": "KEY", "distkey": "song_id", "sortkey": ["start_time"]},
+    "songs": {"diststyle": "KEY", "distkey": "song_id", "sortkey": ["song_id"]},
+    "users": {"diststyle": "ALL", "sortkey": ["user_id"]},
+    "artists": {"diststyle": "ALL", "sortkey": ["artist_id"]},
+    "time": {"diststyle": "ALL", "sortkey": ["starttime"]},
+    "song_lookup": {"diststyle": "ALL", "sortkey": ["song_key"]},
+    "agg_song_plays_daily": {"diststyle": "EVEN", "sortkey": ["day_start"]},
+    "agg_active_users_hourly": {"diststyle": "ALL", "sortkey": ["hour_start"]},
+    "agg_level_location_daily": {"diststyle": "EVEN", "sortkey": ["day_start"]},
+}
+
+# Staging column each analytics column is copied from, so the encoding
+# ANALYZE COMPRESSION recommends for staging data can be reused downstream.
+COLUMN_SOURCES = {
+    "songplay": {
+        "start_time": ("staging_events", "ts"),
+        "user_id": ("staging_events", "userid"),
+        "level": ("staging_events", "level"),
+        "song_id": ("staging_songs", "song_id"),
+        "artist_id": ("staging_songs", "artist_id"),
+        "session_id": ("staging_events", "sessionid"),
+        "location": ("staging_events", "location"),
+        "user_agent": ("staging_events", "useragent"),
+    },
+    "users": {
+        "user_id": ("staging_events", "userid"),
+        "firstname": ("staging_events", "firstname"),
+        "lastname": ("staging_events", "lastname"),
+        "gender": ("staging_events", "gender"),
+        "level": ("staging_events", "level"),
+    },
+    "songs": {
+        "song_id": ("staging_songs", "song_id"),
+        "title": ("staging_songs", "title"),
+        "artist_id": ("staging_songs", "artist_id"),
+        "year": ("staging_songs", "year"),
+        "duration": ("staging_songs", "duration"),
+    },
+    "artists": {
+        "artist_id": ("staging_songs", "artist_id"),
+        "name": ("staging_songs", "artist_name"),
+        "location": ("staging_songs", "artist_location"),
+        "latitude": ("staging_songs", "artist_latitude"),
+        "longitude": ("staging_songs", "artist_longitude"),
+    },
+    "time": {
+        "starttime": ("staging_events", "ts"),
+    },
+    "song_lookup": {
+        "song_id": ("staging_songs", "song_id"),
+        "artist_id": ("staging_songs", "artist_id"),
+    },
+}
+
+# Used when no staging profile is available for a column
+DEFAULT_ENCODINGS = {
+    "bigint": "AZ64",
+    "int": "AZ64",
+    "numeric": "AZ64",
+    "timestamp": "AZ64",
+    "float": "ZSTD",
+    "text": "ZSTD",
+}
+
+PROFILED_TABLES = ["staging_events", "staging_songs"]
+
+
+def parse_create_query(query):
+    """Return (table, [(column, definition)]) from a CREATE TABLE statement."""
+    table = re.search(r"CREATE TABLE IF NOT EXISTS (\w+)", query).group(1)
+    body = query[query.index("(") + 1:query.rindex(")")]
+    columns = []
+    for line in body.splitlines():
+        line = line.strip().rstrip(",")
+        if line:
+            name, definition = line.split(None, 1)
+            columns.append((name, definition))
+    return table, columns
+
+
+def analyze_compression(conn, tables=PROFILED_TABLES):
+    """
+    Run ANALYZE COMPRESSION on each table and return
+    {(table, column): encoding}. Empty or missing tables are skipped.
+    """
+    encodings = {}
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                try:
+                    print(f"Analyzing compression for {table}...")
+                    cur.execute(f"ANALYZE COMPRESSION {table};")
+                    for row_table, column, encoding, _ in cur.fetchall():
+                        encodings[(row_table.strip(), column.strip().lower())] = encoding.strip().upper()
+                except Exception as e:
+                    print(f"Could not analyze compression for {table}: {e}")
+    finally:
+        conn.autocommit = autocommit
+    return encodings
+
+
+def column_encoding(table, column, definition, profile):
+    """Pick an encoding for a column: RAW for the leading sort key, else the profile, else a type default."""
+    layout = TABLE_LAYOUTS.get(table, {})
+    if layout.get("sortkey", [None])[0] == column:
+        return "RAW"
+    source = COLUMN_SOURCES.get(table, {}).get(column.lower(), (table, column.lower()))
+    if source in profile:
+        return profile[source]
+    return DEFAULT_ENCODINGS.get(definition.split()[0].lower(), "ZSTD")
+
+
+def build_create_query(query, profile=None):
+    """Rewrite a CREATE TABLE statement with encodings, distribution and sort keys."""
+    profile = profile or {}
+    table, columns = parse_create_query(query)
+    layout = TABLE_LAYOUTS.get(table, {})
+
+    lines = []
+    for name, definition in columns:
+        # ENCODE is a column attribute and goes before NOT NULL/PRIMARY KEY
+        column_type, constraints = re.match(
+            r"(.*?)\s*((?:NOT NULL|NULL|PRIMARY KEY|UNIQUE).*)?$", definition
+        ).groups()
+        encode = f"ENCODE {column_encoding(table, name, definition, profile)}"
+        lines.append(f"        {name} {' '.join(filter(None, [column_type, encode, constraints]))}")
+    attributes = []
+    if "diststyle" in layout:
+        attributes.append(f"DISTSTYLE {layout['diststyle']}")
+    if "distkey" in layout:
+        attributes.append(f"DISTKEY ({layout['distkey']})")
+    if "sortkey" in layout:
+        attributes.append(f"SORTKEY ({', '.join(layout['sortkey'])})")
+
+    return (
+        f"\n    CREATE TABLE IF NOT EXISTS {table} (\n"
+        + ",\n".join(lines)
+        + "\n    )"
+        + "".join(f"\n    {attribute}" for attribute in attributes)
+        + ";\n"
+    )
+
+
+def layout_create_table_queries(profile=None):
+    """Return create_table_queries rewritten with the physical layout."""
+    return [build_create_query(query, profile) for query in create_table_queries]
+
+
+def main():
+    """Profile the current staging data and print the resulting DDL."""
+    config = load_config('dwh.cfg')
+    with get_manager(config).connection() as conn:
+        profile = analyze_compression(conn)
+    close_all()
+
+    for query in layout_create_table_queries(profile):
+        print(query)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import gzip
+import os
+import sys
+import pandas as pd
+
+from local_loader import CHUNK_SIZE, sanitise_chunk
+from sql_queries import staging_column_types
+
+# Redshift stores TEXT as VARCHAR(256); longer values are cut by TRUNCATECOLUMNS
+TEXT_MAX_BYTES = 256
+
+# Checks applied on top of the column types in sql_queries.staging_column_types.
+# categories: columns read as pandas categoricals; a list restricts the values.
+VALIDATION_RULES = {
+    "staging_events": {
+        "required": ["page", "sessionId", "ts"],
+        "ranges": {
+            "itemInSession": (0, None),
+            "length": (0, None),
+            "sessionId": (0, None),
+            "status": (100, 599),
+            "ts": (0, None),
+            "userId": (0, None),
+        },
+        "categories": {
+            "level": ["free", "paid"],
+            "gender": ["F", "M"],
+            "method": ["GET", "PUT"],
+            "page": None,
+        },
+    },
+    "staging_songs": {
+        "required": ["artist_id", "artist_name", "song_id", "title"],
+        "ranges": {
+            "artist_latitude": (-90, 90),
+            "artist_longitude": (-180, 180),
+            "duration": (0, None),
+            "num_songs": (0, None),
+            "year": (0, 2100),
+        },
+        "categories": {},
+    },
+}
+
+
+def validate_chunk(chunk, table_name):
+    """
+    Validate one chunk of raw strings against the staging DDL and rules.
+
+    Returns (clean, rejects): clean is typed (nullable integers, floats,
+    categoricals) and rejects holds the raw rows with a reject_reason such
+    as "ts:type;userId:range". All checks are column-wise.
+    """
+    rules = VALIDATION_RULES[table_name]
+    column_types = staging_column_types[table_name]
+    clean, type_rejects = sanitise_chunk(chunk, column_types)
+    raw = chunk.loc[clean.index]
+    reasons = pd.Series("", index=clean.index)
+
+    def flag(mask, column, check):
+        nonlocal reasons
+        reasons = reasons.mask(mask, reasons + f"{column}:{check};")
+
+    for column in rules["required"]:
+        flag(clean[column].isna(), column, "null")
+
+    for column, (low, high) in rules["ranges"].items():
+        values = clean[column]
+        out_of_range = pd.Series(False, index=clean.index)
+        if low is not None:
+            out_of_range |= (values < low).fillna(False)
+        if high is not None:
+            out_of_range |= (values > high).fillna(False)
+        flag(out_of_range, column, "range")
+
+    for column, sql_type in column_types.items():
+        if sql_type == "text":
+            too_wide = clean[column].str.encode("utf-8").str.len() > TEXT_MAX_BYTES
+            flag(too_wide.fillna(False), column, "width")
+
+    for column, allowed in rules["categories"].items():
+        if allowed is None:
+            clean[column] = clean[column].astype("category")
+            continue
+        values = clean[column].astype(pd.CategoricalDtype(allowed))
+        flag(raw[column].notna() & values.isna(), column, "category")
+        clean[column] = values
+
+    rejected = reasons != ""
+    rejects = pd.concat([
+        type_rejects.assign(reject_reason=type_rejects["reject_reason"].str.replace(";", ":type;") + ":type"),
+        raw[rejected].assign(reject_reason=reasons[rejected].str.rstrip(";")),
+    ])
+    return clean[~rejected], rejects
+
+
+def validate_csv(table_name, csv_file, clean_file=None, reject_file=None, chunk_size=CHUNK_SIZE):
+    """
+    Validate a CSV in fixed-size chunks, writing a clean file and a reject file.
+
+    Only one chunk is in memory at a time, so multi-GB logs validate in
+    constant memory. Returns (clean_file, clean_rows, rejected_rows).
+    """
+    base = csv_file[:-len(".gz")] if csv_file.endswith(".gz") else csv_file
+    base = os.path.splitext(base)[0]
+    clean_file = clean_file or f"{base}.clean.csv.gz"
+    reject_file = reject_file or f"{base}.rejects.csv"
+
+    clean_rows = rejected_rows = 0
+    first = True
+    open_clean = gzip.open if clean_file.endswith(".gz") else open
+    with open_clean(clean_file, "wt", newline="") as clean_out, open(reject_file, "w", newline="") as reject_out:
+        reader = pd.read_csv(csv_file, dtype=str, chunksize=chunk_size, keep_default_na=False, na_values=[""])
+        for chunk in reader:
+            clean, rejects = validate_chunk(chunk, table_name)
+            clean.to_csv(clean_out, header=first, index=False)
+            rejects.to_csv(reject_out, header=first, index=False)
+            first = False
+            clean_rows += len(clean)
+            rejected_rows += len(rejects)
+
+    print(f"Validated {csv_file}: {clean_rows} clean rows, {rejected_rows} rejected (see {reject_file}).")
+    return clean_file, clean_rows, rejected_rows
+
+
+def main():
+    """Validate data/events.csv and data/songs.csv, or <table> <csv_file> from the command line."""
+    if len(sys.argv) == 3:
+        validate_csv(sys.argv[1], sys.argv[2])
+        return
+    validate_csv("staging_events", os.path.join("data", "events.csv"))
+    validate_csv("staging_songs", os.path.join("data", "songs.csv"))
+
+
+if __name__ == "__main__":
+    main()